@@ -23,5 +23,6 @@ if __name__ == '__main__':
         ],
         packages=find_packages(),
         test_suite='skimpy.test',
-        tests_require=['mock'],
+        tests_require=['mock', 'futures'],
+        extras_require={'futures': ['futures']},
     )
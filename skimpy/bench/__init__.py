@@ -0,0 +1,5 @@
+import timeit
+
+
+def best_of(func, number=1, repeat=3):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
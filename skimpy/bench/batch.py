@@ -0,0 +1,31 @@
+# Compare the batch entry points with calling the per-record methods in
+# a plain loop.
+#
+#     python -m skimpy.bench.batch [records] [fields]
+import sys
+
+from skimpy.bench import best_of
+from skimpy.bench.schemas import nested
+
+
+def main(records=1000, fields=20):
+    schema, flat = nested(fields)
+    flats = [dict(flat) for _ in xrange(records)]
+    els = [schema.from_flat(flat) for flat in flats]
+    print '%d records x %d fields' % (records, len(flat))
+    for name, loop, batch in [
+        ('from_flat', lambda: [schema.from_flat(flat) for flat in flats],
+         lambda: list(schema.from_flat_many(flats))),
+        ('flatten', lambda: [el.flatten() for el in els],
+         lambda: list(schema.flatten_many(els))),
+        ('is_valid', lambda: [el.is_valid() for el in els],
+         lambda: list(schema.validate_many(els))),
+    ]:
+        loop_time = best_of(loop)
+        batch_time = best_of(batch)
+        print '  %-10s loop %.3fs, batch %.3fs (%.1fx)' % (
+            name, loop_time, batch_time, loop_time / batch_time)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
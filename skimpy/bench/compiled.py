@@ -0,0 +1,31 @@
+# Compare the generic from_flat, flatten and is_valid walks with the
+# functions generated by compile_schema.
+#
+#     python -m skimpy.bench.compiled [records] [fields]
+import sys
+
+from skimpy.bench import best_of
+from skimpy.bench.schemas import nested
+from skimpy.compiler import compile_schema
+
+
+def main(records=1000, fields=20):
+    schema, flat = nested(fields)
+    compiled = compile_schema(schema)
+    el = schema.from_flat(flat)
+    print '%d records x %d fields' % (records, len(flat))
+    for name, generic, fast in [
+        ('from_flat', lambda: schema.from_flat(flat),
+         lambda: compiled.from_flat(flat)),
+        ('flatten', el.flatten, lambda: compiled.flatten(el)),
+        ('is_valid', el.is_valid, lambda: compiled.is_valid(el)),
+    ]:
+        generic_time = best_of(generic, records)
+        fast_time = best_of(fast, records)
+        print '  %-10s generic %.1fus, compiled %.1fus (%.1fx)' % (
+            name, generic_time * 1e6, fast_time * 1e6,
+            generic_time / fast_time)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,40 @@
+# Build records from a wide schema, once going through the bound child
+# class cache and once creating a fresh class per access the way
+# ElementType.__getitem__ used to.
+#
+#     python -m skimpy.bench.getitem [records] [fields]
+import sys
+
+from skimpy.bench import best_of
+from skimpy.bench.schemas import wide
+
+
+def build_cached(schema, records):
+    keys = schema.keys()
+    for _ in xrange(records):
+        el = schema()
+        for key in keys:
+            el[key]
+
+
+def build_uncached(schema, records):
+    keys = schema.keys()
+    for _ in xrange(records):
+        el = schema()
+        for key in keys:
+            child = schema.children[key].with_attrs(parent=schema)()
+            child.parent = el
+            el.instances[key] = child
+
+
+def main(records=1000, fields=50):
+    schema, flat = wide(fields)
+    cached = best_of(lambda: build_cached(schema, records))
+    uncached = best_of(lambda: build_uncached(schema, records))
+    print '%d records x %d fields' % (records, fields)
+    print '  uncached: %.3fs' % (uncached,)
+    print '  cached:   %.3fs (%.1fx)' % (cached, uncached / cached)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
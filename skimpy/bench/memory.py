@@ -0,0 +1,44 @@
+# Report the memory held per element by records built from a nested
+# schema, right after from_flat and once flattened and validated. Only
+# the elements' own storage is counted, not the values they hold.
+#
+#     python -m skimpy.bench.memory [fields]
+import sys
+
+from skimpy.bench.schemas import nested
+
+
+def element_size(el):
+    size = sys.getsizeof(el)
+    dct = getattr(el, '__dict__', None)
+    if dct is not None:
+        size += sys.getsizeof(dct)
+        for key in ('instances', 'validation_errors', '_path'):
+            if key in dct:
+                size += sys.getsizeof(dct[key])
+    return size
+
+
+def tree_size(el):
+    size = 0
+    count = 0
+    for el in el._iterdescendants():
+        size += element_size(el)
+        count += 1
+    return size, count
+
+
+def main(fields=20):
+    schema, flat = nested(fields)
+    el = schema.from_flat(flat)
+    print '%d fields' % (len(flat),)
+    size, count = tree_size(el)
+    print '  from_flat:          %d bytes/element' % (size // count,)
+    el.flatten()
+    el.is_valid()
+    size, count = tree_size(el)
+    print '  flatten, is_valid:  %d bytes/element' % (size // count,)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,165 @@
+# Time the element engine on the synthetic schemas and optionally gate on
+# a stored baseline.
+#
+#     python -m skimpy.bench.run [--save FILE] [--baseline FILE]
+#                                [--threshold FRACTION] [CASE ...]
+#
+# Cases are named schema.operation, and a prefix selects several. Each
+# case runs in a process of its own and reports operations per second,
+# how far that process's peak RSS rose while building the schema and
+# running the case, and the size of one record built with from_flat as
+# counted by skimpy.bench.memory. With --baseline, the run fails if any
+# case got slower or its peak grew by more than the threshold (0.2
+# meaning 20%).
+import argparse
+import json
+import marshal
+import os
+import resource
+import sys
+import timeit
+import traceback
+
+from skimpy.bench.memory import tree_size
+from skimpy.bench.schemas import SCHEMAS
+
+
+def _getitem(schema):
+    keys = schema.keys()
+    def getitem():
+        for key in keys:
+            schema[key]
+    return getitem
+
+
+OPERATIONS = [
+    ('from_flat', lambda schema, flat, el: lambda: schema.from_flat(flat)),
+    ('flatten', lambda schema, flat, el: el.flatten),
+    ('is_valid', lambda schema, flat, el: el.is_valid),
+    ('copy', lambda schema, flat, el: el.copy),
+    ('getitem', lambda schema, flat, el: _getitem(schema)),
+]
+
+
+def cases(selected=()):
+    for schema_name, factory in SCHEMAS:
+        for op_name, operation in OPERATIONS:
+            name = '%s.%s' % (schema_name, op_name)
+            if selected and not any(name.startswith(prefix)
+                                    for prefix in selected):
+                continue
+            yield name, factory, operation
+
+
+def ops_per_sec(func, min_time=0.1, repeat=3):
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = min([elapsed] + timeit.repeat(func, number=number,
+                                         repeat=repeat - 1))
+    return number / best
+
+
+def _max_rss():
+    # In kB; macOS reports bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def in_child(func):
+    # Calls func in a forked process and returns its result along with
+    # how far the peak RSS of that process rose above the RSS it started
+    # with, in kB. The result has to be marshallable.
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read)
+            start = _max_rss()
+            result = func()
+            with os.fdopen(write, 'wb') as f:
+                f.write(marshal.dumps((result, _max_rss() - start)))
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError('benchmark process failed')
+    return marshal.loads(data)
+
+
+def _measure(factory, operation):
+    schema, flat = factory()
+    el = schema.from_flat(flat)
+    rate = ops_per_sec(operation(schema, flat, el))
+    size, count = tree_size(schema.from_flat(flat))
+    return rate, size
+
+
+def run(selected=(), out=sys.stdout):
+    results = {}
+    for name, factory, operation in cases(selected):
+        (rate, size), peak = in_child(lambda: _measure(factory, operation))
+        results[name] = {'ops': rate, 'peak_kb': peak}
+        print >>out, '  %-26s %12.1f ops/s %8d kB peak %8d B/record' % (
+            name, rate, peak, size)
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    # Returns (name, measure, baseline value, value) for every case that
+    # got slower, or whose peak grew, by more than threshold. RSS moves
+    # in pages and allocator arenas, so peaks within 1 MB of the baseline
+    # always pass.
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        try:
+            expected = baseline[name]
+        except KeyError:
+            continue
+        if result['ops'] < expected['ops'] * (1 - threshold):
+            regressions.append((name, 'ops', expected['ops'], result['ops']))
+        limit = max(expected['peak_kb'] * (1 + threshold),
+                    expected['peak_kb'] + 1024)
+        if result['peak_kb'] > limit:
+            regressions.append(
+                (name, 'peak_kb', expected['peak_kb'], result['peak_kb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m skimpy.bench.run')
+    parser.add_argument('cases', nargs='*')
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    results = run(args.cases)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, measure, expected, value in regressions:
+            print 'REGRESSION %s: %s %.1f, baseline %.1f (%+.0f%%)' % (
+                name, measure, value, expected, (value / expected - 1) * 100)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
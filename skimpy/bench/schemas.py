@@ -0,0 +1,74 @@
+# Synthetic schemas for the benchmarks. Each factory returns the schema
+# and a flat dict that fills every element in it.
+from skimpy.element import Element, List
+
+
+def _leaves(fields):
+    return dict(('f%d' % (i,), Element) for i in xrange(fields))
+
+
+def _fill(schema, flat, prefix=''):
+    for key in schema:
+        flat[prefix + key] = key
+    return flat
+
+
+def wide(fields=50):
+    schema = type('Wide', (Element,), _leaves(fields))
+    return schema, _fill(schema, {})
+
+
+def nested(fields=20):
+    dct = _leaves(fields)
+    dct['sub'] = type('Sub', (Element,), dict(dct))
+    schema = type('Nested', (Element,), dct)
+    flat = _fill(schema, {})
+    return schema, _fill(schema['sub'], flat, 'sub.')
+
+
+def deep(depth=10, fields=2):
+    schema = type('Level%d' % (depth,), (Element,), _leaves(fields))
+    for level in xrange(depth - 1, 0, -1):
+        dct = _leaves(fields)
+        dct['child'] = schema
+        schema = type('Level%d' % (level,), (Element,), dct)
+    flat = {}
+    prefix = ''
+    cls = schema
+    while True:
+        _fill(cls, flat, prefix)
+        flat.pop(prefix + 'child', None)
+        if 'child' not in cls.children:
+            break
+        prefix += 'child.'
+        cls = cls['child']
+    return schema, flat
+
+
+def list_heavy(items=100, fields=3):
+    item = type('Item', (Element,), _leaves(fields))
+    schema = type('ListHeavy', (Element,), dict(items=List.of(item)))
+    flat = {}
+    for i in xrange(items):
+        _fill(item, flat, 'items.%d.' % (i,))
+    return schema, flat
+
+
+def nested_lists(outer=10, inner=10, fields=2):
+    item = type('Inner', (Element,), _leaves(fields))
+    row = type('Row', (Element,), dict(cells=List.of(item)))
+    schema = type('NestedLists', (Element,), dict(rows=List.of(row)))
+    flat = {}
+    for i in xrange(outer):
+        for j in xrange(inner):
+            _fill(item, flat, 'rows.%d.cells.%d.' % (i, j))
+    return schema, flat
+
+
+SCHEMAS = [
+    ('wide', wide),
+    ('nested', nested),
+    ('deep', deep),
+    ('list_heavy', list_heavy),
+    ('nested_lists', nested_lists),
+]
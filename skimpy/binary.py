@@ -0,0 +1,192 @@
+# Compact binary encoding of converted element trees, for caching them
+# between processes. A record holds the fingerprint of its schema and the
+# marshalled values of all its elements in schema order, so loading it
+# neither parses paths nor runs converters.
+#
+#     data = dumps(el)
+#     el = loads(Schema, data)
+#
+# dump_many writes any number of records of one schema to a file after a
+# single header, and load_many reads them back through a memory map.
+# Values have to be marshallable, and trees with conversion errors are
+# refused, as are schemas with converters that cannot be fingerprinted.
+import hashlib
+import marshal
+import mmap
+import struct
+import sys
+import types
+
+from skimpy import element
+from skimpy.element import List, _link, memoized, vectorized
+
+MAGIC = 'SKB1'
+_HEADER = len(MAGIC) + 8
+_length = struct.Struct('<I')
+_plain = (type(None), bool, int, long, float, complex, str, unicode)
+
+
+def _code(code):
+    return (code.co_code, code.co_names, tuple(
+        _code(const) if isinstance(const, types.CodeType) else const
+        for const in code.co_consts))
+
+
+def _identity(func):
+    # Converters are told apart by what they do, as far as that can be
+    # seen: classes and builtins by module and name, functions by their
+    # code, defaults and closed over values as well. Other callables may
+    # depend on any state and are refused.
+    if isinstance(func, _plain):
+        return func
+    if isinstance(func, tuple):
+        return tuple(map(_identity, func))
+    if isinstance(func, memoized):
+        return ('memoized', _identity(func.func))
+    if isinstance(func, vectorized):
+        return ('vectorized', _identity(func.converter),
+                _identity(func.convert_column))
+    if isinstance(func, types.FunctionType):
+        return (func.__module__, func.__name__, _code(func.func_code),
+                _identity(func.func_defaults),
+                _identity(tuple(cell.cell_contents
+                                for cell in func.func_closure or ())))
+    if isinstance(func, types.ModuleType):
+        return func.__name__
+    if isinstance(func, (type, types.ClassType, types.BuiltinFunctionType)):
+        module = sys.modules.get(func.__module__)
+        if getattr(module, func.__name__, None) is func:
+            return (func.__module__, func.__name__)
+    raise ValueError('cannot fingerprint %r' % (func,))
+
+
+def _structure(cls):
+    if issubclass(cls, List):
+        return ('list', _identity(cls.converter),
+                _structure(cls.element_type))
+    return (_identity(cls.converter),
+            tuple((key, _structure(cls[key])) for key in sorted(cls)))
+
+
+def fingerprint(cls):
+    # Covers the keys, lists and converters of the whole schema. It is
+    # built under the lock schema changes are made under, so it always
+    # matches the generation it is cached with.
+    try:
+        generation, digest = cls.__dict__['_fingerprint']
+        if generation == element._generation:
+            return digest
+    except KeyError:
+        pass
+    with element._lock:
+        generation = element._generation
+        digest = hashlib.sha1(repr(_structure(cls))).digest()[:8]
+        cls._fingerprint = (generation, digest)
+        return digest
+
+
+def _payload(el):
+    # Values in preorder, raw values where they are not the value itself,
+    # and the length of every list.
+    values = []
+    raw_values = {}
+    lengths = []
+    els = [el]
+    while els:
+        el = els.pop()
+        if el.conversion_error is not None:
+            raise ValueError('%s: cannot store conversion errors' % (
+                el.path,))
+        value = el.value
+        if el.raw_value is not value:
+            raw_values[len(values)] = el.raw_value
+        values.append(value)
+        if isinstance(el, List):
+            lengths.append(len(el))
+            children = list(el)
+        else:
+            children = [el[key] for key in sorted(el.__class__)]
+        children.reverse()
+        els.extend(children)
+    return marshal.dumps((values, raw_values, lengths), 2)
+
+
+def _build(cls, (values, raw_values, lengths)):
+    # Elements are new, so attributes go straight into __dict__ as in the
+    # compiled from_flat.
+    values = iter(values)
+    lengths = iter(lengths)
+    idx = 0
+    root = None
+    stack = [(cls, None, None)]
+    while stack:
+        cls, parent, key = stack.pop()
+        el = cls()
+        dct = el.__dict__
+        value = dct['value'] = next(values)
+        raw_value = raw_values.get(idx, value)
+        if raw_value is not None:
+            dct['raw_value'] = raw_value
+        idx += 1
+        if parent is None:
+            root = el
+        elif isinstance(parent, List):
+            _link(el, parent)
+            dct['name'] = key
+            list.append(parent, el)
+        else:
+            _link(el, parent)
+            parent.instances[key] = el
+        if isinstance(el, List):
+            item = cls.element_type
+            stack.extend((item, el, str(i))
+                         for i in reversed(xrange(next(lengths))))
+        else:
+            stack.extend((cls[key], el, key)
+                         for key in reversed(sorted(cls)))
+    return root
+
+
+def _check_header(cls, data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a binary element record')
+    if data[len(MAGIC):_HEADER] != fingerprint(cls):
+        raise ValueError('record was written for another schema than %s' % (
+            cls.__name__,))
+
+
+def dumps(el):
+    return MAGIC + fingerprint(el.__class__) + _payload(el)
+
+
+def loads(cls, data):
+    _check_header(cls, data)
+    return _build(cls, marshal.loads(buffer(data, _HEADER)))
+
+
+def dump_many(cls, els, f):
+    digest = fingerprint(cls)
+    f.write(MAGIC + digest)
+    for el in els:
+        if fingerprint(el.__class__) != digest:
+            raise ValueError('%r does not belong to schema %s' % (
+                el, cls.__name__))
+        payload = _payload(el)
+        f.write(_length.pack(len(payload)))
+        f.write(payload)
+
+
+def load_many(cls, f):
+    # Reads the records of a file written by dump_many one at a time from
+    # a read-only memory map of it.
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        _check_header(cls, data)
+        offset = _HEADER
+        while offset < len(data):
+            length, = _length.unpack_from(data, offset)
+            offset += _length.size
+            yield _build(cls, marshal.loads(buffer(data, offset, length)))
+            offset += length
+    finally:
+        data.close()
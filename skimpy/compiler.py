@@ -0,0 +1,225 @@
+import weakref
+
+from skimpy import element
+from skimpy.element import (
+    Element, _find_node, _flatten_child, _index_flat, _missing)
+
+
+# Methods whose generic behavior the generated code inlines. Classes that
+# override any of them (List among them) are handed to the generic
+# methods instead.
+_GENERIC = (
+    '__getitem__',
+    '__iter__',
+    '_from_flat',
+    '_from_flat_children',
+    '_iterchildren',
+    'iterflatten',
+    'flatten',
+    '_validate_children',
+    'is_valid',
+)
+
+
+def _is_plain(cls):
+    for name in _GENERIC:
+        if getattr(cls, name).im_func is not getattr(Element, name).im_func:
+            return False
+    return True
+
+
+class _Node(object):
+    def __init__(self, cls, var, key=None, parent=None):
+        self.cls = cls
+        self.var = var
+        self.key = key
+        self.parent = parent
+        self.path = cls.path
+        self.plain = _is_plain(cls)
+        self.children = []
+
+    def __iter__(self):
+        yield self
+        for child in self.children:
+            for node in child:
+                yield node
+
+
+def _schema_tree(cls):
+    root = _Node(cls, 0)
+    count = 1
+    search = [root]
+    while search:
+        node = search.pop()
+        if not node.plain:
+            continue
+        for key in node.cls:
+            child = _Node(node.cls[key], count, key, node)
+            count += 1
+            node.children.append(child)
+            search.append(child)
+    return root
+
+
+class _Source(object):
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+
+    def __call__(self, line, *args):
+        self.lines.append('    ' * self.indent + line % args)
+
+    def __str__(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _fetch_child(src, node):
+    src('try:')
+    src('    e%d = e%d.instances[%r]', node.var, node.parent.var, node.key)
+    src('except KeyError:')
+    src('    e%d = e%d[%r]', node.var, node.parent.var, node.key)
+
+
+def _from_flat_source(src, root):
+    src('def from_flat(flat, convert=True, strict=False):')
+    src.indent += 1
+    src('get = flat.get')
+    src('index = None')
+    src("lazy = convert == 'lazy'")
+    src('e0 = C0()')
+    # The elements are new, so there are no path caches to clear and
+    # nothing to mark as changed; attributes go straight into __dict__.
+    for node in root:
+        if node.parent is not None:
+            src('e%d = C%d()', node.var, node.var)
+            src("e%d.__dict__['parent'] = (ref(e%d) if C%d.weak_parent "
+                "else e%d)", node.var, node.parent.var, node.var,
+                node.parent.var)
+            src('e%d.instances[%r] = e%d', node.parent.var, node.key, node.var)
+        if node.plain:
+            src('value = get(%r, missing)', node.path)
+            src('if value is not missing:')
+            src("    e%d.__dict__['raw_value'] = value", node.var)
+            src('if lazy:')
+            src("    e%d.__dict__['_unconverted'] = strict", node.var)
+            src('elif convert:')
+            src('    e%d._convert_new(strict)', node.var)
+        else:
+            src('if index is None:')
+            src('    index = index_flat(flat)')
+            src('e%d._from_flat(find_node(index, %r), convert, strict)',
+                node.var, node.path)
+    src('return e0')
+    src.indent -= 1
+
+
+def _flatten_node_source(src, node):
+    src('if include_empty or e%d.value is not None:', node.var)
+    src('    if adapt:')
+    src('        e%d.adapt()', node.var)
+    src('        flat[%r] = e%d.raw_value', node.path, node.var)
+    src('    else:')
+    src('        flat[%r] = e%d.value', node.path, node.var)
+    for child in node.children:
+        _fetch_child(src, child)
+        if child.plain:
+            src('if type(e%d) is C%d and e%d.path == %r:',
+                child.var, child.var, child.var, child.path)
+            src.indent += 1
+            _flatten_node_source(src, child)
+            src.indent -= 1
+            src('else:')
+            src.indent += 1
+        src('flat.update(flatten_child(e%d, adapt, include_empty))',
+            child.var)
+        if child.plain:
+            src.indent -= 1
+
+
+def _flatten_source(src, root):
+    src('def flatten(e0, adapt=True, include_empty=False):')
+    src.indent += 1
+    src('if type(e0) is not C0 or e0.path != %r:', root.path)
+    src('    return e0.flatten(adapt, include_empty)')
+    src('flat = {}')
+    _flatten_node_source(src, root)
+    src('return flat')
+    src.indent -= 1
+
+
+def _validate_children_source(src, node):
+    for child in node.children:
+        _fetch_child(src, child)
+        if child.plain:
+            src('if type(e%d) is C%d:', child.var, child.var)
+            src.indent += 1
+            src('r%d = True', child.var)
+            _validate_children_source(src, child)
+            src('r%d = e%d.is_valid(False) and r%d',
+                child.var, child.var, child.var)
+            src.indent -= 1
+            src('else:')
+            src.indent += 1
+        src('r%d = e%d._validate_children()', child.var, child.var)
+        src('r%d = e%d.is_valid(False) and r%d',
+            child.var, child.var, child.var)
+        if child.plain:
+            src.indent -= 1
+        src("e%d.__dict__['_valid'] = r%d", child.var, child.var)
+        src('if not r%d:', child.var)
+        src('    r%d = False', node.var)
+
+
+def _is_valid_source(src, root):
+    src('def is_valid(e0):')
+    src.indent += 1
+    src('if type(e0) is not C0:')
+    src('    return e0.is_valid()')
+    src("e0.__dict__.pop('validation_errors', None)")
+    src('r0 = True')
+    _validate_children_source(src, root)
+    src('r0 = e0._run_validators() and r0')
+    src("e0.__dict__['_valid'] = r0")
+    src('return r0')
+    src.indent -= 1
+
+
+class CompiledSchema(object):
+    def __init__(self, cls):
+        self.element_type = cls
+        root = _schema_tree(cls)
+        src = _Source()
+        if root.plain:
+            _from_flat_source(src, root)
+            _flatten_source(src, root)
+            _is_valid_source(src, root)
+        self.source = str(src)
+        namespace = dict(
+            missing=_missing,
+            index_flat=_index_flat,
+            find_node=_find_node,
+            flatten_child=_flatten_child,
+            ref=weakref.ref,
+        )
+        for node in root:
+            namespace['C%d' % (node.var,)] = node.cls
+        code = compile(self.source, '<schema %s>' % (cls.__name__,), 'exec')
+        exec code in namespace
+        self.from_flat = namespace.get('from_flat', cls.from_flat)
+        self.flatten = namespace.get('flatten', cls.flatten.im_func)
+        self.is_valid = namespace.get('is_valid', cls.is_valid.im_func)
+
+
+def compile_schema(cls):
+    try:
+        generation, compiled = cls.__dict__['_compiled']
+        if generation == element._generation:
+            return compiled
+    except KeyError:
+        pass
+    with element._lock:
+        generation, compiled = cls.__dict__.get('_compiled', (None, None))
+        if generation != element._generation:
+            compiled = CompiledSchema(cls)
+            cls._compiled = (element._generation, compiled)
+        return compiled
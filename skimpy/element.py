@@ -1,3 +1,439 @@
+import copy_reg
+import operator
+import sys
+import threading
+import weakref
+from timeit import default_timer as _timer
+from urllib import unquote_plus
+
+
+# Class-level state (children dicts, the caches of bound child classes
+# and compiled schemas, the generation and the registry of shared
+# elements) may be used from any number of threads at once. Reads take no
+# lock; updates are made under _lock, or _sharing_lock for the registry.
+# Element instances are not locked: a tree is only ever to be used by one
+# thread at a time, async_is_valid aside.
+_lock = threading.RLock()
+# Reentrant, as collecting garbage may call _unshared while it is held.
+_sharing_lock = threading.RLock()
+_generation = 0
+# Weak references to the elements whose children are still shared with
+# live copies, by id. Kept here rather than on the elements, so that an
+# element drops out even when it is collected along with its copies.
+_sharing = {}
+# Set through skimpy.instrument; None turns all recording off.
+_recorder = None
+_missing = object()
+_VALUE = object()
+
+
+def _index_flat(flat):
+    return _index_items(flat.iteritems())
+
+
+def _index_items(items):
+    # Split every dotted key once into a tree of nested dicts; the value
+    # for a path is stored in its node under _VALUE.
+    index = {}
+    for key, value in items:
+        node = index
+        if key:
+            for part in key.split('.'):
+                try:
+                    node = node[part]
+                except KeyError:
+                    node[part] = {}
+                    node = node[part]
+        node[_VALUE] = value
+    return index
+
+
+class _encoded(object):
+    # A value from a urlencoded body, decoded only once it lands on an
+    # element.
+    __slots__ = ('value', 'encoding')
+
+    def __init__(self, value, encoding):
+        self.value = value
+        self.encoding = encoding
+
+    def decode(self):
+        value = self.value
+        if '%' in value or '+' in value:
+            value = unquote_plus(value)
+        if self.encoding is not None:
+            value = value.decode(self.encoding)
+        return value
+
+
+def _iter_urlencoded(data, encoding):
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif not isinstance(data, str):
+        data = str(data)
+    for pair in data.split('&'):
+        if not pair:
+            continue
+        key, _, value = pair.partition('=')
+        if '%' in key or '+' in key:
+            key = unquote_plus(key)
+        if encoding is not None:
+            try:
+                key = key.decode(encoding)
+            except UnicodeDecodeError:
+                # No schema has such a key.
+                continue
+        yield key, _encoded(value, encoding)
+
+
+def _find_node(index, path):
+    node = index
+    if path:
+        for part in path.split('.'):
+            node = node.get(part)
+            if node is None:
+                break
+    return node
+
+
+_split_paths = {}
+
+
+def _split_path(path):
+    # Parsed paths are kept around for get_path; the cache is simply
+    # emptied when it grows too large.
+    try:
+        return _split_paths[path]
+    except KeyError:
+        if len(_split_paths) >= 10000:
+            _split_paths.clear()
+        parts = _split_paths[path] = tuple(path.split('.')) if path else ()
+        return parts
+
+
+def _build_value(event, value, events):
+    # Assembles the data for one value from parser events.
+    if event == 'start_map':
+        result = {}
+        for event, key in events:
+            if event == 'end_map':
+                break
+            event, value = next(events)
+            result[key] = _build_value(event, value, events)
+        return result
+    if event == 'start_array':
+        result = []
+        for event, value in events:
+            if event == 'end_array':
+                break
+            result.append(_build_value(event, value, events))
+        return result
+    return value
+
+
+def _timed(kind, path, func):
+    recorder = _recorder
+    def timed(*args):
+        start = _timer()
+        try:
+            return func(*args)
+        finally:
+            recorder.record(kind, path, None, _timer() - start)
+    return timed
+
+
+class _attr(object):
+    # Per-instance state that can also be given a class-level default,
+    # e.g. with with_attrs(name=...). ElementType wraps such defaults in
+    # a new descriptor of the same kind, so assignments on instances
+    # always go through __set__.
+    def __init__(self, name, default=_missing):
+        self.name = name
+        self.default = default
+
+    def __get__(self, obj, cls):
+        if obj is not None:
+            try:
+                return obj.__dict__[self.name]
+            except KeyError:
+                pass
+        if self.default is _missing:
+            raise AttributeError(self.name)
+        return self.default
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        self.changed(obj)
+
+    def __delete__(self, obj):
+        try:
+            del obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+        self.changed(obj)
+
+    def changed(self, obj):
+        pass
+
+
+class _path_attr(_attr):
+    def changed(self, obj):
+        obj._clear_path()
+        obj._changed()
+
+
+class _parent_attr(_path_attr):
+    # Elements whose class sets weak_parent only hold a weak reference to
+    # their parent, so trees are freed by refcounting alone. Once such a
+    # parent is gone, the class-level parent stands in for it.
+    def __get__(self, obj, cls):
+        if obj is not None:
+            try:
+                parent = obj.__dict__['parent']
+            except KeyError:
+                pass
+            else:
+                if type(parent) is not weakref.ref:
+                    return parent
+                parent = parent()
+                if parent is not None:
+                    return parent
+        return _path_attr.__get__(self, None, cls)
+
+    def __set__(self, obj, value):
+        if value is not None and obj.weak_parent:
+            value = weakref.ref(value)
+        _path_attr.__set__(self, obj, value)
+
+
+def _link(child, parent):
+    # Sets a new element's parent without marking anything as changed.
+    if child.weak_parent:
+        parent = weakref.ref(parent)
+    child.__dict__['parent'] = parent
+
+
+def _parent_of(el):
+    parent = el.__dict__.get('parent')
+    if type(parent) is weakref.ref:
+        return parent()
+    return parent
+
+
+_attrs = {
+    'name': _path_attr,
+    'parent': _parent_attr,
+}
+
+_value_attrs = frozenset(['raw_value', 'value', 'conversion_error'])
+
+
+class _converted(object):
+    # Class-level default of value and conversion_error. Elements loaded
+    # with convert='lazy' only convert when either is first looked up;
+    # from then on the instance attribute shadows the descriptor.
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self.default
+        if '_unconverted' in obj.__dict__:
+            obj._convert_pending()
+            return obj.__dict__.get(self.name, self.default)
+        return self.default
+
+
+_converted_attrs = ('value', 'conversion_error')
+# Part of the schema structure that is fingerprinted by skimpy.binary.
+_structure_attrs = ('converter', 'element_type')
+
+
+class _lazy(object):
+    # Per-instance container that is only created when first looked up,
+    # so that leaves stay small; from then on the instance attribute
+    # shadows the descriptor.
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return ()
+        value = obj.__dict__[self.name] = self.factory()
+        return value
+
+
+class _unstored(list):
+    # The empty list a _lazy_list hands out; it is only stored on the
+    # element once something is added to it.
+    __slots__ = ('obj', 'name')
+
+    def __init__(self, obj, name):
+        self.obj = obj
+        self.name = name
+
+
+def _storing(method):
+    def store(self, *args):
+        self.obj._attach()
+        stored = self.obj.__dict__.setdefault(self.name, self)
+        return method(stored, *args)
+    store.__name__ = method.__name__
+    return store
+
+
+for _name in (
+    '__setitem__', '__setslice__', '__iadd__', 'append', 'extend', 'insert',
+):
+    setattr(_unstored, _name, _storing(getattr(list, _name)))
+del _name
+
+
+class _lazy_list(object):
+    # Reading does not store anything, so that leaves that are only
+    # looked at stay small.
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return ()
+        return _unstored(obj, self.name)
+
+
+# Caches and bookkeeping that a copy does not take over.
+_uncopied = ('_path', '_valid', 'validation_errors', 'instances', '_copies',
+             '_frozen', '_source', '_detached')
+
+# The views handed out for the children elements still share, by
+# (id(owner), key); see _view.
+_views = {}
+
+
+def _drop_view(ref):
+    if _views.get(ref.key) is ref:
+        del _views[ref.key]
+
+
+def _view(owner, key, shared, attach=False):
+    # Children that owner still shares with its source are looked up as
+    # copies of the shared child that are linked to owner but are not
+    # among its children, so reads leave both trees alone. The first
+    # write to such a view makes it one of owner's children (see
+    # Element._attach); until then the same view is handed out for as
+    # long as it is in use. With attach, the view is made a child of
+    # owner right away and the caller stores it.
+    ref = _views.get((id(owner), key))
+    if ref is not None:
+        view = ref()
+        # List items move about, so there the view has to stand for the
+        # same item still.
+        if (view is not None and '_detached' in view.__dict__ and
+                _parent_of(view) is owner and
+                (view.__dict__['_detached'][1] is shared or
+                 not isinstance(owner, List))):
+            if attach:
+                del view.__dict__['_detached']
+                del _views[ref.key]
+            return view
+    if '_unconverted' in shared.__dict__:
+        # Deferred conversions are not writes, so the shared child can
+        # take the result for every copy.
+        shared._convert_new(shared.__dict__['_unconverted'])
+    view = shared.copy()
+    _link(view, owner)
+    if isinstance(owner, List):
+        view.__dict__['name'] = str(key)
+    if not attach:
+        # Held strongly, so that chains of views whose classes set
+        # weak_parent can still be attached.
+        view.__dict__['_detached'] = (key, shared, owner)
+        _views[id(owner), key] = weakref.KeyedRef(
+            view, _drop_view, (id(owner), key))
+    return view
+
+
+def _live_views(owner, keys):
+    for key in keys:
+        ref = _views.get((id(owner), key))
+        view = None if ref is None else ref()
+        if view is not None and _parent_of(view) is owner:
+            yield view
+
+
+def _unshared(ref):
+    # Also called by weakref once the element ref points to is gone.
+    with _sharing_lock:
+        if ref is not None and _sharing.get(ref.key) is ref:
+            del _sharing[ref.key]
+
+
+def _dropped(ref):
+    # A copy registered with _share is gone.
+    copy_id, source = ref.key
+    source = source()
+    if source is not None:
+        source._unregister(copy_id, ref)
+
+
+# Frozen subtrees shared through Element.intern, by _intern_key.
+_interned = weakref.WeakValueDictionary()
+
+
+def _intern_key(el):
+    # The classes, list lengths and values of a whole subtree, in schema
+    # order; None if any value is unhashable.
+    key = []
+    for sub in el._iterdescendants():
+        raw_value = sub.raw_value
+        value = sub.value
+        key.append((sub.__class__, len(sub) if isinstance(sub, list) else 0,
+                    raw_value.__class__, raw_value, value.__class__, value,
+                    sub.conversion_error))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _frozen_copy(el):
+    # A copy of the whole subtree of el that owns all of its elements, for
+    # Element.intern; it is never written to.
+    dct = el.__dict__.copy()
+    for key in _uncopied + ('parent',):
+        dct.pop(key, None)
+    dct['_frozen'] = True
+    frozen = type(el)()
+    object.__setattr__(frozen, '__dict__', dct)
+    if isinstance(el, List):
+        for idx, item in enumerate(el):
+            item = _frozen_copy(item)
+            _link(item, frozen)
+            item.__dict__['name'] = str(idx)
+            list.append(frozen, item)
+    else:
+        for key in el:
+            child = frozen.instances[key] = _frozen_copy(el[key])
+            _link(child, frozen)
+    return frozen
+
+
+def _wrap_attrs(dct):
+    # Descriptors, e.g. properties, are left to compute the attribute
+    # themselves.
+    for key, attr in _attrs.iteritems():
+        if key in dct and not hasattr(type(dct[key]), '__get__'):
+            dct[key] = attr(key, dct[key])
+    for key in _converted_attrs:
+        if key in dct and not hasattr(type(dct[key]), '__get__'):
+            dct[key] = _converted(key, dct[key])
+    return dct
+
+
 class ElementType(type):
     def __new__(cls, name, bases, dct):
         children = dct['children'] = {}
@@ -7,20 +443,85 @@ class ElementType(type):
             if key != 'element_type':
                 del dct[key]
                 value = children[key] = value.with_attrs(name=key)
-        return type.__new__(cls, name, bases, dct)
+        self = type.__new__(cls, name, bases, _wrap_attrs(dct))
+        for key, child in children.iteritems():
+            child._origin = (_child, (self, key))
+        return self
+
+    def __setattr__(self, key, value):
+        global _generation
+        if key in _converted_attrs:
+            value = _wrap_attrs({key: value})[key]
+        elif key in _attrs or key in _structure_attrs:
+            value = _wrap_attrs({key: value})[key]
+            with _lock:
+                type.__setattr__(self, key, value)
+                _generation += 1
+            return
+        type.__setattr__(self, key, value)
+
+    def __delattr__(self, key):
+        global _generation
+        if key in _attrs or key in _structure_attrs:
+            with _lock:
+                type.__delattr__(self, key)
+                _generation += 1
+            return
+        type.__delattr__(self, key)
 
     def __getitem__(self, key):
-        search = [self]
-        while search:
-            cls = search.pop()
-            search.extend(reversed(cls.__bases__))
-            if not isinstance(cls, ElementType) or key not in cls.children:
-                continue
-            return cls.children[key].with_attrs(parent=self)
+        bound = self._bound_children()
+        try:
+            return bound[key]
+        except KeyError:
+            pass
+        with _lock:
+            # Another thread may have bound it in the meantime.
+            bound = self._bound_children()
+            try:
+                return bound[key]
+            except KeyError:
+                pass
+            search = [self]
+            while search:
+                cls = search.pop()
+                search.extend(reversed(cls.__bases__))
+                if (not isinstance(cls, ElementType) or
+                        key not in cls.children):
+                    continue
+                child = cls.children[key].with_attrs(parent=self)
+                child._origin = (operator.getitem, (self, key))
+                bound[key] = child
+                return child
         raise KeyError(key)
 
     def __setitem__(self, key, value):
-        self.children[key] = value
+        global _generation
+        with _lock:
+            # Replaced rather than changed, so that other threads can go
+            # on iterating over the old children.
+            children = dict(self.children)
+            children[key] = value
+            type.__setattr__(self, 'children', children)
+            _generation += 1
+
+    def _bound_children(self):
+        # Bound child classes are cached on the parent class itself, so
+        # they are collected along with it. Any change to a children dict
+        # or to a class-level name or parent bumps the generation, which
+        # discards every cache.
+        try:
+            generation, bound = self.__dict__['_bound']
+            if generation == _generation:
+                return bound
+        except KeyError:
+            pass
+        with _lock:
+            generation, bound = self.__dict__.get('_bound', (None, None))
+            if generation != _generation:
+                bound = {}
+                self._bound = (_generation, bound)
+            return bound
 
     def __iter__(self):
         seen = set()
@@ -49,37 +550,115 @@ class ElementType(type):
     def values(self):
         return list(self.itervalues())
 
+    def get_path(self, path):
+        cls = self
+        for key in _split_path(path):
+            element_type = getattr(cls, 'element_type', None)
+            if element_type is not None and key.isdigit():
+                cls = cls._bound_item(int(key))
+            else:
+                cls = cls[key]
+        return cls
+
+    def _bound_item(self, idx):
+        # The item class of a List class, bound to it under idx so that
+        # its path is that of the items it stands for. Cached along with
+        # the bound children, under the int rather than the key.
+        bound = self._bound_children()
+        try:
+            return bound[idx]
+        except KeyError:
+            pass
+        with _lock:
+            bound = self._bound_children()
+            try:
+                return bound[idx]
+            except KeyError:
+                pass
+            item = self.element_type.with_attrs(parent=self, name=str(idx))
+            item._origin = (_item, (self, idx))
+            bound[idx] = item
+            return item
+
     def with_attrs(self, **kw):
-        return type.__new__(ElementType, self.__name__, (self,), kw)
+        origin = (_with_attrs, (self, dict(kw)))
+        cls = type.__new__(
+            ElementType, self.__name__, (self,), _wrap_attrs(kw))
+        cls._origin = origin
+        return cls
+
+
+# Classes built at runtime are pickled as a recipe for building them
+# again from an importable class; all others are pickled by name.
+def _reduce_element_type(cls):
+    try:
+        return cls.__dict__['_origin']
+    except KeyError:
+        return cls.__name__
+
+
+def _child(cls, key):
+    return cls.children[key]
+
+
+def _item(cls, idx):
+    return cls._bound_item(idx)
+
+
+class _metamethod(object):
+    # A method that, looked up on a class, is the ElementType method of
+    # the same name instead.
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return getattr(type(cls), self.func.__name__).__get__(cls)
+        return self.func.__get__(obj, cls)
+
+
+def _with_attrs(cls, kw):
+    return cls.with_attrs(**kw)
+
+
+copy_reg.pickle(ElementType, _reduce_element_type)
 
 
 class Element(object):
     __metaclass__ = ElementType
     raw_value = None
-    value = None
+    value = _converted('value')
     converter = None
-    conversion_error = None
+    conversion_error = _converted('conversion_error')
     adapter = None
     validators = ()
-    validation_errors = ()
-
-    def __new__(cls, *args, **kw):
-        self = object.__new__(cls)
-        self.instances = {}
-        return self
+    weak_parent = False
+    validation_errors = _lazy_list('validation_errors')
+    instances = _lazy('instances', dict)
 
     def __getitem__(self, key):
+        dct = self.__dict__
         try:
-            inst = self.instances[key]
+            return dct['instances'][key]
         except KeyError:
-            inst = self.instances[key] = self.__class__[key]()
-            inst.parent = self
+            pass
+        if '_source' in dct:
+            shared = self._shared_child(key)
+            if shared is not None:
+                return _view(self, key, shared)
+        if '_detached' in dct:
+            self._attach()
+        inst = self.instances[key] = self.__class__[key]()
+        _link(inst, self)
         return inst
 
     def __setitem__(self, key, value):
+        self._attach()
+        self._unshare()
         value = value.copy()
         value.parent = self
         self.instances[key] = value
+        self._changed()
 
     def __iter__(self):
         return self.__class__.__class__.__iter__(self.__class__)
@@ -95,170 +674,865 @@ class Element(object):
     def values(self):
         return list(self.itervalues())
 
+    def _child(self, key):
+        return self[key]
+
+    @_metamethod
+    def get_path(self, path):
+        # Paths are relative to self, e.g. 'orders.3.lines.0.sku'.
+        el = self
+        for key in _split_path(path):
+            el = el._child(key)
+        return el
+
+    def set_path(self, path, value):
+        self.get_path(path).value = value
+
     def copy(self):
+        # Copies are made on write: the copy shares its children with self,
+        # and only takes its own of each once it is written to, or of all
+        # of them once self or one of its ancestors is.
         copy = type(self)()
-        copy.__dict__ = self.__dict__.copy()
-        for el in copy.itervalues():
-            el.parent = copy
+        dct = self.__dict__.copy()
+        for key in _uncopied:
+            dct.pop(key, None)
+        if self._has_children():
+            dct['_source'] = self
+            # Frozen elements are never written to, so their copies need
+            # not be told about writes.
+            if '_frozen' not in self.__dict__:
+                self._share(copy)
+        object.__setattr__(copy, '__dict__', dct)
         return copy
 
+    def _has_children(self):
+        dct = self.__dict__
+        return bool(dct.get('instances')) or (
+            '_source' in dct and dct['_source']._has_children())
+
+    def _shared_child(self, key):
+        # The child self still shares for key, if any; sources are copies
+        # themselves at times.
+        source = self.__dict__.get('_source')
+        while source is not None:
+            dct = source.__dict__
+            try:
+                return dct['instances'][key]
+            except KeyError:
+                source = dct.get('_source')
+        return None
+
+    def _share(self, copy):
+        # Copies are held weakly and unregister themselves once they are
+        # gone.
+        try:
+            copies = self.__dict__['_copies']
+        except KeyError:
+            copies = self.__dict__['_copies'] = {}
+            with _sharing_lock:
+                _sharing[id(self)] = weakref.KeyedRef(
+                    self, _unshared, id(self))
+        copies[id(copy)] = weakref.KeyedRef(
+            copy, _dropped, (id(copy), weakref.ref(self)))
+
+    def _unregister(self, copy_id, ref=None):
+        dct = self.__dict__
+        copies = dct.get('_copies')
+        if copies is None or (ref is not None and
+                              copies.get(copy_id) is not ref):
+            return
+        copies.pop(copy_id, None)
+        if not copies and dct.pop('_copies', None) is not None:
+            _unshared(_sharing.get(id(self)))
+
+    def _live_copies(self):
+        copies = self.__dict__.get('_copies')
+        if copies is None:
+            return []
+        return [copy for copy in (ref() for ref in copies.values())
+                if copy is not None]
+
+    def _unshare(self):
+        # Called before self is written to; copies still sharing the
+        # children of self or of one of its ancestors take their own,
+        # from the top down, so the write does not show through them.
+        if not _sharing:
+            return
+        els = []
+        el = self
+        while isinstance(el, Element):
+            els.append(el)
+            el = _parent_of(el)
+        for el in reversed(els):
+            for copy in el._live_copies():
+                copy._materialize()
+
+    def _materialize(self):
+        # Takes own children for all those self still shares: the views
+        # handed out for them so far, and new ones for the rest. Elements
+        # below a view are never its own, so a view is attached first.
+        dct = self.__dict__
+        if '_source' not in dct:
+            return
+        self._attach()
+        source = dct.pop('_source')
+        instances = self.instances
+        el = source
+        while el is not None:
+            for key, child in el.__dict__.get('instances', {}).iteritems():
+                if key not in instances:
+                    instances[key] = _view(self, key, child, attach=True)
+            el = el.__dict__.get('_source')
+        source._unregister(id(self))
+        # The new children are unvalidated.
+        self._changed()
+
+    def _attach(self):
+        # Makes a view (see _view) the child of its owner that it stands
+        # for, along with the views it was looked up through; called
+        # before it is written to.
+        detached = self.__dict__.pop('_detached', None)
+        if detached is None:
+            return
+        key, shared, owner = detached
+        owner._attach()
+        ref = _views.get((id(owner), key))
+        if ref is not None and ref() is self:
+            del _views[ref.key]
+        owner._adopt(key, shared, self)
+        owner._changed()
+
+    def _adopt(self, key, shared, child):
+        # Views of children that have been replaced since stay detached.
+        self.instances.setdefault(key, child)
+
+    def intern(self, *paths):
+        # Replaces the subtrees at paths (relative to self; every child
+        # that has children when none are given) with copies of one frozen
+        # subtree shared by all equal subtrees interned so far. Reads leave
+        # the copies sharing it; like any other copy, one only takes its
+        # own children, a level at a time, where it is written to.
+        if paths:
+            els = [self.get_path(path) for path in paths]
+        else:
+            els = [el for el in self._iterchildren() if el._has_children()]
+        for el in els:
+            parent = _parent_of(el)
+            key = _intern_key(el)
+            if parent is None or key is None:
+                continue
+            with _lock:
+                frozen = _interned.get(key)
+                if frozen is None:
+                    frozen = _interned[key] = _frozen_copy(el)
+                    frozen.__dict__.pop('name', None)
+            shared = frozen.copy()
+            for attr in ('parent', 'name'):
+                if attr in el.__dict__:
+                    shared.__dict__[attr] = el.__dict__[attr]
+            parent._attach()
+            if isinstance(parent, List):
+                list.__setitem__(parent, int(el.name), shared)
+            else:
+                parent.instances[el.name] = shared
+            # The shared copy starts out unvalidated.
+            parent._changed()
+        return self
+
+    name = _path_attr('name')
+    parent = _parent_attr('parent')
+
     class path(object):
+        # Paths are cached on the element or class they belong to.
+        # Instance caches are cleared along with those of all descendants
+        # whenever a name or parent is assigned; class-level changes bump
+        # the generation instead. A path is cached under the generation
+        # it was built in, so one built while another thread changed the
+        # schema is built again on the next look up.
         def __get__(self, obj, cls):
-            path = []
             el = cls if obj is None else obj
-            while True:
+            current = _generation
+            try:
+                generation, path = el.__dict__['_path']
+                if generation == current:
+                    return path
+            except KeyError:
+                pass
+            try:
+                name = el.name
+            except AttributeError:
+                path = ''
+            else:
                 try:
-                    path.append(el.name)
-                    el = el.parent
+                    parent = el.parent
+                    parent.name
                 except AttributeError:
-                    break
-            path.reverse()
-            return '.'.join(path)
+                    path = name
+                else:
+                    path = parent.path + '.' + name
+            if obj is None:
+                setattr(cls, '_path', (current, path))
+            else:
+                obj.__dict__['_path'] = (current, path)
+            return path
     path = path()
 
+    def _clear_path(self):
+        els = [self]
+        while els:
+            el = els.pop()
+            if el.__dict__.pop('_path', None) is not None:
+                els.extend(el._child_instances())
+
+    def _child_instances(self):
+        dct = self.__dict__
+        children = dct.get('instances', {}).values()
+        if '_source' in dct:
+            # Views of shared children cache their paths too.
+            keys = set()
+            el = dct['_source']
+            while el is not None:
+                keys.update(el.__dict__.get('instances', ()))
+                el = el.__dict__.get('_source')
+            children.extend(_live_views(self, keys))
+        return children
+
+    def _changed(self):
+        # An element is clean while it holds the result of validating its
+        # whole subtree in _valid. Ancestors of a dirty element are always
+        # dirty, so marking stops at the first dirty one.
+        el = self
+        while (isinstance(el, Element) and
+               el.__dict__.pop('_valid', _missing) is not _missing):
+            el = _parent_of(el)
+
+    def __setattr__(self, key, value):
+        dct = self.__dict__
+        # Nothing is shared in the common case.
+        if _sharing or '_detached' in dct:
+            self._attach()
+            self._unshare()
+        object.__setattr__(self, key, value)
+        if key in _value_attrs:
+            if key == 'value' and '_unconverted' in dct:
+                del dct['_unconverted']
+            if '_valid' in dct:
+                self._changed()
+
+    def __delattr__(self, key):
+        dct = self.__dict__
+        if _sharing or '_detached' in dct:
+            self._attach()
+            self._unshare()
+        object.__delattr__(self, key)
+        if key in _value_attrs and '_valid' in dct:
+            self._changed()
+
+    @property
+    def dirty(self):
+        return '_valid' not in self.__dict__
+
     def convert(self, strict=True):
+        value, error = self._conversion(strict)
+        if error is None:
+            self.value = value
+        else:
+            self.conversion_error = error
+
+    def _conversion(self, strict):
+        # (value, None), or (None, error) for a failed conversion that is
+        # not strict.
         if self.converter is None:
-            self.value = self.raw_value
+            return self.raw_value, None
+        recorder = _recorder
+        if recorder is not None:
+            start = _timer()
+        try:
+            return self.converter(self.raw_value), None
+        except Exception, inst:
+            if strict:
+                raise
+            return None, inst
+        finally:
+            if recorder is not None:
+                recorder.record('convert', self.path, None, _timer() - start)
+
+    def _convert_new(self, strict):
+        # For elements that are being built and for deferred conversions:
+        # neither is a write, so the results go straight into __dict__.
+        # A strict conversion that fails stays pending.
+        value, error = self._conversion(strict)
+        dct = self.__dict__
+        dct.pop('_unconverted', None)
+        if error is None:
+            dct['value'] = value
         else:
-            try:
-                self.value = self.converter(self.raw_value)
-            except Exception, inst:
-                if strict:
-                    raise
-                self.conversion_error = inst
+            dct['conversion_error'] = error
+
+    def _load_value(self, convert, strict):
+        # With convert='lazy' conversion waits until value or
+        # conversion_error is looked up, or the element is validated;
+        # strict is kept until then.
+        if convert == 'lazy':
+            self.__dict__['_unconverted'] = strict
+        elif convert:
+            self._convert_new(strict)
+
+    def _convert_pending(self):
+        strict = self.__dict__.get('_unconverted')
+        if strict is not None:
+            self._convert_new(strict)
 
     def adapt(self):
+        # raw_value is derived from value here, so the element is not
+        # marked as changed.
         if self.adapter is None:
-            self.raw_value = self.value
+            self.__dict__['raw_value'] = self.value
+            return
+        recorder = _recorder
+        if recorder is None:
+            self.__dict__['raw_value'] = self.adapter(self.value)
+            return
+        start = _timer()
+        try:
+            self.__dict__['raw_value'] = self.adapter(self.value)
+        finally:
+            recorder.record('adapt', self.path, None, _timer() - start)
+
+    def _from_flat(self, node, convert=True, strict=False):
+        error = None
+        if node is not None:
+            try:
+                value = node[_VALUE]
+            except KeyError:
+                pass
+            else:
+                if type(value) is _encoded:
+                    # Undecodable values are kept as bytes and count as
+                    # conversion errors.
+                    try:
+                        value = value.decode()
+                    except UnicodeDecodeError, error:
+                        if strict:
+                            raise
+                        value = unquote_plus(value.value)
+                self.__dict__['raw_value'] = value
+        if error is None:
+            self._load_value(convert, strict)
         else:
-            self.raw_value = self.adapter(self.value)
+            self.__dict__['conversion_error'] = error
+        self._from_flat_children(node or {}, convert, strict)
 
-    def _from_flat(self, flat, convert=True, strict=False):
-        try:
-            self.raw_value = flat[self.path]
-        except KeyError:
-            pass
-        if convert:
-            self.convert(strict)
+    def _from_flat_children(self, node, convert=True, strict=False):
+        for key in self:
+            self[key]._from_flat(node.get(key), convert, strict)
 
     @classmethod
     def from_flat(cls, flat, convert=True, strict=False):
+        recorder = _recorder
+        if recorder is not None:
+            start = _timer()
         root = cls()
-        els = [root]
-        while els:
-            el = els.pop()
-            els.extend(el.itervalues())
-            el._from_flat(flat, convert, strict)
+        node = _find_node(_index_flat(flat), cls.path)
+        root._from_flat(node, convert, strict)
+        if recorder is not None:
+            recorder.record('from_flat', cls.path, None, _timer() - start)
         return root
 
-    def _flatten_children(self, flat, adapt=True, include_empty=False):
-        for child in self.itervalues():
-            flat.update(child.flatten(adapt, include_empty))
+    @classmethod
+    def from_urlencoded(cls, data, convert=True, strict=False,
+                        encoding='utf-8'):
+        # Takes a form body or query string as str, bytearray, buffer or
+        # memoryview. Keys are split into the path index as they are
+        # parsed; values are only decoded for the paths the schema has,
+        # into unicode unless encoding is None. Repeated keys keep the
+        # last value.
+        recorder = _recorder
+        if recorder is not None:
+            start = _timer()
+        root = cls()
+        index = _index_items(_iter_urlencoded(data, encoding))
+        root._from_flat(_find_node(index, cls.path), convert, strict)
+        if recorder is not None:
+            recorder.record('from_urlencoded', cls.path, None,
+                            _timer() - start)
+        return root
+
+    def _from_nested(self, data, convert=True, strict=False):
+        keys = list(self)
+        if not (keys and isinstance(data, dict)):
+            if data is not None:
+                self.__dict__['raw_value'] = data
+            data = {}
+        self._load_value(convert, strict)
+        for key in keys:
+            self[key]._from_nested(data.get(key), convert, strict)
+
+    @classmethod
+    def from_nested(cls, data, convert=True, strict=False):
+        # Dicts map onto child elements and lists onto List items; any
+        # other data is the raw value of the element it lands on. Unlike
+        # from_flat, data is relative to the root, whatever its name.
+        recorder = _recorder
+        if recorder is not None:
+            start = _timer()
+        root = cls()
+        root._from_nested(data, convert, strict)
+        if recorder is not None:
+            recorder.record('from_nested', cls.path, None, _timer() - start)
+        return root
+
+    def _from_events(self, event, value, events, convert=True,
+                     strict=False):
+        keys = set(self)
+        if not (keys and event == 'start_map'):
+            self._from_nested(_build_value(event, value, events), convert,
+                              strict)
+            return
+        self._load_value(convert, strict)
+        for event, key in events:
+            if event == 'end_map':
+                break
+            event, value = next(events)
+            if key in keys:
+                keys.remove(key)
+                self[key]._from_events(event, value, events, convert, strict)
+            else:
+                _build_value(event, value, events)
+        for key in keys:
+            self[key]._from_nested(None, convert, strict)
+
+    @classmethod
+    def from_events(cls, events, convert=True, strict=False):
+        # Builds the element from (event, value) pairs as produced by
+        # ijson.basic_parse, without building the nested data first.
+        recorder = _recorder
+        if recorder is not None:
+            start = _timer()
+        events = iter(events)
+        event, value = next(events)
+        root = cls()
+        root._from_events(event, value, events, convert, strict)
+        if recorder is not None:
+            recorder.record('from_events', cls.path, None, _timer() - start)
+        return root
+
+    @classmethod
+    def _compile(cls):
+        from skimpy.compiler import compile_schema
+        return compile_schema(cls)
+
+    @classmethod
+    def from_flat_many(cls, flats, convert=True, strict=False,
+                       columnar=False):
+        from_flat = cls._compile().from_flat
+        if _recorder is not None:
+            from_flat = _timed('from_flat', cls.path, from_flat)
+        if convert == 'lazy' or not (convert and columnar):
+            return (from_flat(flat, convert, strict) for flat in flats)
+        els = [from_flat(flat, False) for flat in flats]
+        _convert_columns(els, strict)
+        return iter(els)
+
+    def _iterchildren(self):
+        return self.itervalues()
+
+    def iterflatten(self, adapt=True, include_empty=False):
+        # Descendants whose class overrides flatten or iterflatten are
+        # left to flatten themselves.
+        els = [self]
+        while els:
+            el = els.pop()
+            if el is not self:
+                cls = el.__class__
+                if (cls.flatten.im_func is not _generic_flatten or
+                        cls.iterflatten.im_func is not _generic_iterflatten):
+                    for item in _flatten_child(el, adapt, include_empty):
+                        yield item
+                    continue
+            if include_empty or el.value is not None:
+                if adapt:
+                    el.adapt()
+                    yield el.path, el.raw_value
+                else:
+                    yield el.path, el.value
+            children = list(el._iterchildren())
+            children.reverse()
+            els.extend(children)
 
     def flatten(self, adapt=True, include_empty=False):
-        flat = {}
-        if include_empty or self.value is not None:
+        recorder = _recorder
+        if recorder is not None:
+            start = _timer()
+        flat = dict(self.iterflatten(adapt, include_empty))
+        if recorder is not None:
+            recorder.record('flatten', self.path, None, _timer() - start)
+        return flat
+
+    @classmethod
+    def flatten_many(cls, elements, adapt=True, include_empty=False):
+        flatten = cls._compile().flatten
+        if _recorder is not None:
+            flatten = _timed('flatten', cls.path, flatten)
+        for el in elements:
+            yield flatten(el, adapt, include_empty)
+
+    def to_nested(self, adapt=True, include_empty=False):
+        nested = self._to_nested(adapt, include_empty)
+        if nested is _missing:
+            return None
+        return nested
+
+    def _to_nested(self, adapt, include_empty):
+        keys = list(self)
+        if not keys:
+            if self.value is None and not include_empty:
+                return _missing
             if adapt:
                 self.adapt()
-                flat[self.path] = self.raw_value
+                return self.raw_value
+            return self.value
+        nested = {}
+        for key in keys:
+            value = self[key]._to_nested(adapt, include_empty)
+            if value is not _missing:
+                nested[key] = value
+        if not (nested or include_empty):
+            return _missing
+        return nested
+
+    def _iterdescendants(self):
+        els = [self]
+        while els:
+            el = els.pop()
+            yield el
+            els.extend(el._iterchildren())
+
+    def checkpoint(self):
+        # Values are compared by equality, so values that are mutated in
+        # place should be replaced instead for the change to be seen.
+        self._checkpoint = dict(
+            (el.path, el.value) for el in self._iterdescendants())
+
+    def flatten_changes(self, adapt=True, include_empty=False):
+        # Returns the flat items that differ from the last checkpoint, and
+        # the set of checkpointed paths that would no longer be flattened.
+        # Without a checkpoint everything counts as changed.
+        old = self.__dict__.get('_checkpoint', {})
+        flat = {}
+        current = set()
+        for el in self._iterdescendants():
+            value = el.value
+            if value is None and not include_empty:
+                continue
+            path = el.path
+            current.add(path)
+            prev = old.get(path, _missing)
+            if prev is value or (prev is not _missing and prev == value):
+                continue
+            if adapt:
+                el.adapt()
+                flat[path] = el.raw_value
             else:
-                flat[self.path] = self.value
-        self._flatten_children(flat, adapt, include_empty)
-        return flat
+                flat[path] = value
+        removed = set(
+            path for path, value in old.iteritems()
+            if path not in current and (include_empty or value is not None))
+        return flat, removed
 
-    def _validate_children(self):
+    def _validate_children(self, incremental=False):
         result = True
-        for child in self.itervalues():
-            if not child._validate_children():
-                result = False
-            if not child.is_valid(recursive=False):
+        for child in self._iterchildren():
+            valid = None
+            if incremental:
+                valid = child.__dict__.get('_valid')
+            if valid is None:
+                valid = child._validate_children(incremental)
+                valid = child.is_valid(recursive=False) and valid
+                child.__dict__['_valid'] = valid
+            if not valid:
                 result = False
         return result
 
-    def is_valid(self, recursive=True):
-        self.validation_errors = []
-        result = True
-        if recursive and not self._validate_children():
-            result = False
+    def _run_validators(self):
+        if '_unconverted' in self.__dict__:
+            self._convert_pending()
+        recorder = _recorder
         for validator in self.validators:
+            if recorder is not None:
+                start = _timer()
             try:
                 if not validator(self):
                     return False
             except Exception, err:
                 self.validation_errors.append(err)
                 return False
+            finally:
+                if recorder is not None:
+                    recorder.record(
+                        'validate', self.path,
+                        getattr(validator, '__name__', repr(validator)),
+                        _timer() - start)
+        return True
+
+    def is_valid(self, recursive=True, incremental=False):
+        if recursive and incremental:
+            try:
+                return self.__dict__['_valid']
+            except KeyError:
+                pass
+        self.__dict__.pop('validation_errors', None)
+        result = True
+        if recursive and not self._validate_children(incremental):
+            result = False
+        result = self._run_validators() and result
+        if recursive:
+            self.__dict__['_valid'] = result
         return result
 
+    def async_is_valid(self, max_concurrency=10, pool=None):
+        # Validates the same elements as is_valid(), on a thread pool, and
+        # stores the results the same way. An element is submitted as soon
+        # as all of its children are done, so validators in independent
+        # subtrees run concurrently.
+        if pool is None:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(max_concurrency)
+            try:
+                return self.async_is_valid(pool=pool)
+            finally:
+                pool.close()
+                pool.join()
+        els = [self]
+        parents = [None]
+        remaining = [0]
+        for idx, el in enumerate(els):
+            for child in el._iterchildren():
+                els.append(child)
+                parents.append(idx)
+                remaining.append(0)
+                remaining[idx] += 1
+        valid = [True] * len(els)
+        lock = threading.Lock()
+        done = threading.Event()
+        state = dict(exc_info=None)
+
+        def run(idx):
+            try:
+                if idx:
+                    return els[idx].is_valid(False)
+                return self._run_validators()
+            except:
+                state['exc_info'] = sys.exc_info()
+                return False
+
+        def complete(idx, result):
+            with lock:
+                # All children are done by now, so valid[idx] holds the
+                # result of their subtrees.
+                result = valid[idx] = result and valid[idx]
+                if state['exc_info'] is None:
+                    els[idx].__dict__['_valid'] = result
+                if idx:
+                    parent = parents[idx]
+                    valid[parent] = valid[parent] and result
+                    remaining[parent] -= 1
+                    ready = not remaining[parent]
+            if not idx:
+                done.set()
+            elif ready:
+                submit(parent)
+
+        def submit(idx):
+            pool.apply_async(
+                run, (idx,), callback=lambda result: complete(idx, result))
+
+        self.__dict__.pop('validation_errors', None)
+        for idx, count in enumerate(remaining):
+            if not count:
+                submit(idx)
+        done.wait()
+        if state['exc_info'] is not None:
+            raise state['exc_info'][0], state['exc_info'][1], \
+                state['exc_info'][2]
+        return valid[0]
+
+    @classmethod
+    def validate_many(cls, elements):
+        is_valid = cls._compile().is_valid
+        for el in elements:
+            yield is_valid(el)
+
+
+_generic_flatten = Element.flatten.im_func
+_generic_iterflatten = Element.iterflatten.im_func
+
+
+def _flatten_child(el, adapt, include_empty):
+    if el.__class__.flatten.im_func is not _generic_flatten:
+        return el.flatten(adapt, include_empty).iteritems()
+    return el.iterflatten(adapt, include_empty)
+
+
+class _unloaded(object):
+    # Stands in for an item of a lazy List until it is first looked up.
+    __slots__ = ('method', 'data', 'convert', 'strict')
+
+    def __init__(self, method, data, convert, strict):
+        self.method = method
+        self.data = data
+        self.convert = convert
+        self.strict = strict
+
+    def __repr__(self):
+        return '<unloaded item>'
+
 
 class List(list, Element):
+    # Lazy lists only note the data for each item on ingest and build
+    # the item the first time it is looked up.
+    lazy = False
+
     def __iter__(self):
         for i in xrange(len(self)):
             yield self[i]
 
+    def __reversed__(self):
+        for i in reversed(xrange(len(self))):
+            yield self[i]
+
     def __getitem__(self, idx):
         if isinstance(idx, slice):
-            return type(self)(list.__getitem__(self, idx))
+            return type(self)(
+                [self[i] for i in xrange(*idx.indices(len(self)))])
         child = list.__getitem__(self, idx)
-        child.name = str(len(self) + idx if idx < 0 else idx)
-        child.parent = self
+        if idx < 0:
+            idx += len(self)
+        name = str(idx)
+        if type(child) is _unloaded:
+            return self._load(idx, name, child)
+        # Items are looked up far more often than they move, so only
+        # their __dict__ is read unless they have.
+        dct = child.__dict__
+        parent = dct.get('parent')
+        if parent is not self and (type(parent) is not weakref.ref or
+                                   parent() is not self):
+            if '_source' in self.__dict__:
+                # Until it is written to, a copy only holds the items of
+                # its source.
+                return _view(self, idx, child)
+            child.parent = self
+        if dct.get('name') != name and getattr(child, 'name', None) != name:
+            child.name = name
         return child
 
+    def __getslice__(self, i, j):
+        return [self[idx] for idx in xrange(*slice(i, j).indices(len(self)))]
+
+    def _load(self, idx, name, item):
+        el = self.element_type()
+        _link(el, self)
+        el.__dict__['name'] = name
+        getattr(el, item.method)(item.data, item.convert, item.strict)
+        list.__setitem__(self, idx, el)
+        if '_detached' in self.__dict__:
+            # Attached along with self on the first write.
+            el.__dict__['_detached'] = (idx, el, self)
+        return el
+
+    def _load_all(self):
+        for el in self:
+            pass
+
+    def pop(self, idx=-1):
+        if self.lazy:
+            # Only the item handed out is built.
+            self[idx]
+        return list.pop(self, idx)
+
+    def _child(self, key):
+        if key.isdigit():
+            return self[int(key)]
+        raise KeyError(key)
+
     def append_new(self):
         self.append(self.element_type())
         return self[-1]
 
-    def _extract_sub_items(self, flat):
-        path = self.path
-        prefix_len = len(path)
-        for key, value in flat.iteritems():
-            if not (
-                key[:prefix_len] == path and
-                key[prefix_len:prefix_len + 1] == '.'
-            ):
-                continue
-            sub_key = key[prefix_len + 1:]
-            try:
-                idx, sub_key = sub_key.split('.', 1)
-            except ValueError:
-                idx = sub_key
-                sub_key = path
-            else:
-                sub_key = path + '.' + sub_key
-            if not idx.isdigit():
-                continue
-            yield int(idx), sub_key, value
-
-    def _extract_flats(self, flat):
-        flats = []
-        last_idx = None
-        for idx, sub_key, value in sorted(
-            self._extract_sub_items(flat),
-            key=lambda (idx, sub_key, value): idx
-        ):
-            if idx != last_idx:
-                flats.append({})
-                last_idx = idx
-            flats[-1][sub_key] = value
-        return flats
-
-    def _from_flat(self, flat, convert=True, strict=False):
-        Element._from_flat(self, flat, convert, strict)
-        element_type = self.element_type.with_attrs(name=self.name)
-        for sub_flat in self._extract_flats(flat):
-            self.append(element_type.from_flat(sub_flat, convert, strict))
-
-    def _flatten_children(self, flat, adapt=True, include_empty=False):
-        for child in self:
-            flat.update(child.flatten(adapt, include_empty))
-
-    def _validate_children(self):
-        result = True
-        for child in self:
-            if not child._validate_children():
-                result = False
-            if not child.is_valid(recursive=False):
-                result = False
-        return result
+    def _append_new(self):
+        # For lists that are being built: nothing to unshare or mark as
+        # changed.
+        el = self.element_type()
+        _link(el, self)
+        el.__dict__['name'] = str(len(self))
+        list.append(self, el)
+        return el
+
+    def _from_flat_children(self, node, convert=True, strict=False):
+        items = sorted(
+            ((int(key), sub) for key, sub in node.iteritems()
+             if key is not _VALUE and key.isdigit()),
+            key=lambda (idx, sub): idx
+        )
+        if self.lazy:
+            list.extend(self, [_unloaded('_from_flat', sub, convert, strict)
+                               for idx, sub in items])
+            return
+        for idx, sub in items:
+            self._append_new()._from_flat(sub, convert, strict)
+
+    def _iterchildren(self):
+        return iter(self)
+
+    def _from_nested(self, data, convert=True, strict=False):
+        if isinstance(data, (list, tuple)):
+            items = data
+        else:
+            items = ()
+            if data is not None:
+                self.__dict__['raw_value'] = data
+        self._load_value(convert, strict)
+        if self.lazy:
+            list.extend(self, [_unloaded('_from_nested', item, convert, strict)
+                               for item in items])
+            return
+        for item in items:
+            self._append_new()._from_nested(item, convert, strict)
+
+    def _from_events(self, event, value, events, convert=True,
+                     strict=False):
+        if event != 'start_array':
+            self._from_nested(_build_value(event, value, events), convert,
+                              strict)
+            return
+        self._load_value(convert, strict)
+        for event, value in events:
+            if event == 'end_array':
+                break
+            self._append_new()._from_events(event, value, events, convert,
+                                            strict)
+
+    def _to_nested(self, adapt, include_empty):
+        # Items without values stay in as None, to keep the indexes.
+        nested = []
+        for item in self:
+            value = item._to_nested(adapt, include_empty)
+            nested.append(None if value is _missing else value)
+        if not (nested or include_empty):
+            return _missing
+        return nested
+
+    def _child_instances(self):
+        for el in Element._child_instances(self):
+            yield el
+        shared = '_source' in self.__dict__
+        for el in list.__iter__(self):
+            if type(el) is not _unloaded and not (
+                    shared and _parent_of(el) is not self):
+                yield el
+        if shared:
+            for el in _live_views(self, xrange(len(self))):
+                yield el
 
     @classmethod
     def of(cls, element):
@@ -271,9 +1545,85 @@ class List(list, Element):
 
     def copy(self):
         new_list = Element.copy(self)
-        new_list[:] = self[:]
+        list.extend(new_list, list.__iter__(self))
         return new_list
 
+    def _has_children(self):
+        return len(self) > 0 or Element._has_children(self)
+
+    def _materialize(self):
+        if '_source' not in self.__dict__:
+            return
+        self._attach()
+        # Copies of self hold the items it shares as well, so they take
+        # their own first.
+        for copy in self._live_copies():
+            copy._materialize()
+        for idx, item in enumerate(list.__iter__(self)):
+            # Unloaded items never change, so they can stay shared.
+            if type(item) is not _unloaded and _parent_of(item) is not self:
+                list.__setitem__(self, idx,
+                                 _view(self, idx, item, attach=True))
+        Element._materialize(self)
+
+    def _adopt(self, idx, shared, child):
+        # Items may have moved since the view was handed out; views of
+        # items that are gone stay detached.
+        if idx >= len(self) or list.__getitem__(self, idx) is not shared:
+            for idx, item in enumerate(list.__iter__(self)):
+                if item is shared:
+                    break
+            else:
+                return
+        child.__dict__['name'] = str(idx)
+        list.__setitem__(self, idx, child)
+
+
+def _mutator(method, load=False):
+    def mutator(self, *args, **kw):
+        self._attach()
+        self._unshare()
+        self._materialize()
+        if load and self.lazy:
+            # These hand out or compare items.
+            self._load_all()
+        result = method(self, *args, **kw)
+        self._changed()
+        return result
+    mutator.__name__ = method.__name__
+    return mutator
+
+
+for _name in (
+    '__setitem__', '__delitem__', '__setslice__', '__delslice__',
+    '__iadd__', '__imul__', 'append', 'extend', 'insert', 'reverse',
+):
+    setattr(List, _name, _mutator(getattr(list, _name)))
+for _name in ('remove', 'sort'):
+    setattr(List, _name, _mutator(getattr(list, _name), load=True))
+List.pop = _mutator(List.pop.im_func)
+
+
+def _reader(method):
+    # Inherited list methods that see the items, lazy Lists among the
+    # arguments included.
+    def reader(self, *args):
+        for el in (self,) + args:
+            if isinstance(el, List) and el.lazy:
+                el._load_all()
+        return method(self, *args)
+    reader.__name__ = method.__name__
+    return reader
+
+
+for _name in (
+    '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__',
+    '__contains__', '__add__', '__mul__', '__rmul__', '__repr__', 'count',
+    'index',
+):
+    setattr(List, _name, _reader(getattr(list, _name)))
+del _name
+
 
 def with_attrs(*args, **kw):
     def with_attrs(element):
@@ -281,3 +1631,110 @@ def with_attrs(*args, **kw):
     if args:
         return with_attrs(*args)
     return with_attrs
+
+
+class vectorized(object):
+    def __init__(self, converter, convert_column):
+        self.converter = converter
+        self.convert_column = convert_column
+
+    def __call__(self, value):
+        return self.converter(value)
+
+
+class memoized(object):
+    # Caches the results of a converter or adapter, failures included, so
+    # that repeated raw values are converted once. The cache keeps two
+    # generations of up to maxsize entries each: hits in the older one are
+    # moved to the newer one, and the older one is dropped whenever the
+    # newer one fills up, which approximates LRU eviction. Instances can
+    # be shared between threads: races may only lose cache entries and
+    # make the hit and miss counts approximate.
+    def __init__(self, func, maxsize=1024):
+        self.func = func
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._current = {}
+        self._previous = {}
+
+    def __call__(self, value):
+        # Keyed by type too, so that e.g. 1 and True are cached apart.
+        key = (value.__class__, value)
+        try:
+            ok, result = self._current[key]
+        except KeyError:
+            try:
+                ok, result = self._previous.pop(key)
+            except KeyError:
+                self.misses += 1
+                try:
+                    ok, result = True, self.func(value)
+                except Exception, inst:
+                    ok, result = False, inst
+            else:
+                self.hits += 1
+            if len(self._current) >= self.maxsize:
+                self._previous = self._current
+                self._current = {}
+            self._current[key] = (ok, result)
+        except TypeError:
+            # Unhashable values are not cached.
+            return self.func(value)
+        else:
+            self.hits += 1
+        if not ok:
+            raise result
+        return result
+
+
+def numpy_converter(dtype, converter=None):
+    import numpy
+    def convert_column(values):
+        return numpy.asarray(values, dtype=dtype).tolist()
+    if converter is None:
+        converter = lambda value: numpy.asarray(value, dtype=dtype).item()
+    return vectorized(converter, convert_column)
+
+
+def _convert_columns(els, strict=False):
+    # Group the elements of a batch by class and run converters that
+    # declare a convert_column once per column. Missing values, and whole
+    # columns whose conversion fails, go through Element.convert one by
+    # one so that conversion errors land on the right element.
+    columns = {}
+    for root in els:
+        search = [root]
+        while search:
+            el = search.pop()
+            children = list(el._iterchildren())
+            children.reverse()
+            search.extend(children)
+            columns.setdefault(type(el), []).append(el)
+    for cls, column in columns.iteritems():
+        convert_column = getattr(cls.converter, 'convert_column', None)
+        if (
+            convert_column is None or
+            cls.convert.im_func is not Element.convert.im_func
+        ):
+            for el in column:
+                el.convert(strict)
+            continue
+        present = []
+        for el in column:
+            if el.raw_value is None:
+                el.convert(strict)
+            else:
+                present.append(el)
+        try:
+            values = convert_column([el.raw_value for el in present])
+        except Exception:
+            for el in present:
+                el.convert(strict)
+        else:
+            for el, value in zip(present, values):
+                el.value = value
+
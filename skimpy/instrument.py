@@ -0,0 +1,72 @@
+# Optional timing of conversion, adaptation, validators and of whole
+# ingest (from_flat, from_urlencoded, from_nested, from_events) and
+# flatten calls. Until a recorder is enabled each hook costs a single
+# global lookup.
+#
+#     with recording() as recorder:
+#         Schema.from_flat(flat).is_valid()
+#     recorder.as_dict()
+import threading
+from contextlib import contextmanager
+
+from skimpy import element
+
+
+class Recorder(object):
+    # Events are identified by kind ('convert', 'adapt', 'validate',
+    # 'from_flat', 'from_urlencoded', 'from_nested', 'from_events' or
+    # 'flatten'), element path and, for validators, the validator's name.
+    # stats maps each of them to [count, seconds]; the callback, if any,
+    # is called with every single event, from whichever thread the event
+    # happened in.
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, path, name, seconds):
+        key = (kind, path, name)
+        with self._lock:
+            try:
+                stat = self.stats[key]
+            except KeyError:
+                stat = self.stats[key] = [0, 0.0]
+            stat[0] += 1
+            stat[1] += seconds
+        if self.callback is not None:
+            self.callback(kind, path, name, seconds)
+
+    def clear(self):
+        self.stats.clear()
+
+    def as_dict(self):
+        # {kind: {path: {'count': ..., 'time': ...}}}, with validators
+        # listed as 'path:name'.
+        result = {}
+        for (kind, path, name), (count, seconds) in self.stats.iteritems():
+            if name is not None:
+                path = '%s:%s' % (path, name)
+            result.setdefault(kind, {})[path] = dict(count=count,
+                                                     time=seconds)
+        return result
+
+
+def enable(recorder=None):
+    if recorder is None:
+        recorder = Recorder()
+    element._recorder = recorder
+    return recorder
+
+
+def disable():
+    element._recorder = None
+
+
+@contextmanager
+def recording(recorder=None):
+    previous = element._recorder
+    recorder = enable(recorder)
+    try:
+        yield recorder
+    finally:
+        element._recorder = previous
@@ -0,0 +1,120 @@
+import cPickle as pickle
+import multiprocessing
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+
+ValidationResult = namedtuple(
+    'ValidationResult', 'valid validation_errors conversion_errors')
+
+_schemas = {}
+
+
+def _load_schema(data):
+    try:
+        return _schemas[data]
+    except KeyError:
+        schema = _schemas[data] = pickle.loads(data)
+        return schema
+
+
+def _result(el, valid):
+    validation_errors = {}
+    conversion_errors = {}
+    search = [el]
+    while search:
+        el = search.pop()
+        search.extend(el._iterchildren())
+        errors = el.__dict__.get('validation_errors')
+        if errors:
+            validation_errors[el.path] = list(errors)
+        if el.conversion_error is not None:
+            conversion_errors[el.path] = el.conversion_error
+    return ValidationResult(valid, validation_errors, conversion_errors)
+
+
+def _validate_flats(schema, flats):
+    is_valid = schema._compile().is_valid
+    return [_result(el, is_valid(el)) for el in schema.from_flat_many(flats)]
+
+
+def _validate_chunk(data, flats):
+    return _validate_flats(_load_schema(data), flats)
+
+
+def _chunks(flats, chunksize):
+    flats = list(flats)
+    return [flats[i:i + chunksize] for i in xrange(0, len(flats), chunksize)]
+
+
+def _call(args):
+    func, args = args
+    return func(*args)
+
+
+class _PoolExecutor(object):
+    # The part of the concurrent.futures executor interface used here, on
+    # a multiprocessing pool, for when the futures backport is not
+    # installed.
+    def __init__(self, pool):
+        self.pool = pool
+
+    def map(self, func, *iterables):
+        return self.pool.map(_call, [(func, args) for args in zip(*iterables)])
+
+    def shutdown(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def _process_executor(max_workers):
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        return _PoolExecutor(multiprocessing.Pool(max_workers))
+    return ProcessPoolExecutor(max_workers)
+
+
+def _thread_executor(max_workers):
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        return _PoolExecutor(ThreadPool(max_workers))
+    return ThreadPoolExecutor(max_workers)
+
+
+def validate_parallel(schema, flats, chunksize=100, max_workers=None,
+                      executor=None):
+    if executor is None:
+        executor = _process_executor(max_workers)
+        try:
+            return validate_parallel(schema, flats, chunksize,
+                                     executor=executor)
+        finally:
+            executor.shutdown()
+    data = pickle.dumps(schema, pickle.HIGHEST_PROTOCOL)
+    chunks = _chunks(flats, chunksize)
+    results = []
+    for chunk in executor.map(_validate_chunk, [data] * len(chunks), chunks):
+        results.extend(chunk)
+    return results
+
+
+def validate_threaded(schema, flats, chunksize=10, max_workers=None,
+                      executor=None):
+    # Like validate_parallel, but on a thread pool within this process,
+    # which pays off for validators that release the GIL or wait on I/O.
+    # The schema itself is shared by all threads.
+    if executor is None:
+        executor = _thread_executor(max_workers)
+        try:
+            return validate_threaded(schema, flats, chunksize,
+                                     executor=executor)
+        finally:
+            executor.shutdown()
+    chunks = _chunks(flats, chunksize)
+    results = []
+    for chunk in executor.map(_validate_flats, [schema] * len(chunks),
+                              chunks):
+        results.extend(chunk)
+    return results
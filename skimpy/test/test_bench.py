@@ -0,0 +1,50 @@
+import unittest
+
+from skimpy.bench.run import cases, compare, in_child
+from skimpy.bench.schemas import SCHEMAS
+
+
+class TestSchemas(unittest.TestCase):
+    def test_flat_fills_every_element(self):
+        for name, factory in SCHEMAS:
+            schema, flat = factory()
+            self.assertEqual(schema.from_flat(flat).flatten(), flat, name)
+
+
+class TestRun(unittest.TestCase):
+    def test_cases_can_be_selected_by_prefix(self):
+        names = [name for name, factory, operation in cases(['deep.'])]
+        self.assertEqual(names, ['deep.from_flat', 'deep.flatten',
+                                 'deep.is_valid', 'deep.copy',
+                                 'deep.getitem'])
+
+    def test_compare_reports_cases_slower_than_threshold(self):
+        baseline = {'a': 100.0, 'b': 100.0, 'c': 100.0}
+        results = {'a': 85.0, 'b': 75.0, 'c': 150.0, 'd': 1.0}
+        baseline = dict((name, {'ops': ops, 'peak_kb': 0})
+                        for name, ops in baseline.iteritems())
+        results = dict((name, {'ops': ops, 'peak_kb': 0})
+                       for name, ops in results.iteritems())
+        self.assertEqual(compare(results, baseline, 0.2),
+                         [('b', 'ops', 100.0, 75.0)])
+
+    def test_compare_reports_peaks_above_threshold(self):
+        baseline = {'a': {'ops': 1.0, 'peak_kb': 10000},
+                    'b': {'ops': 1.0, 'peak_kb': 10000},
+                    'c': {'ops': 1.0, 'peak_kb': 100}}
+        results = {'a': {'ops': 1.0, 'peak_kb': 11000},
+                   'b': {'ops': 1.0, 'peak_kb': 13000},
+                   'c': {'ops': 1.0, 'peak_kb': 1000}}
+        self.assertEqual(compare(results, baseline, 0.2),
+                         [('b', 'peak_kb', 10000, 13000)])
+
+    def test_in_child_reports_peak_of_its_process(self):
+        result, peak = in_child(lambda: len(' ' * (20 << 20)))
+        self.assertEqual(result, 20 << 20)
+        self.assertTrue(peak >= 20 << 10, peak)
+        result, peak = in_child(lambda: 1)
+        self.assertTrue(peak < 20 << 10, peak)
+
+
+if __name__ == '__main__':
+    unittest.main()
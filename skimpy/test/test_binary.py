@@ -0,0 +1,117 @@
+import tempfile
+import unittest
+
+from skimpy.element import *
+from skimpy.binary import *
+
+
+class TestBinary(unittest.TestCase):
+    def test_round_trip(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+            class b(Element):
+                c = Element.with_attrs(converter=float)
+                d = Element
+            @List.of
+            class l(Element):
+                e = Element.with_attrs(converter=int)
+                f = List.of(Element)
+        el = Schema.from_flat({
+            'a': '1', 'b.c': '2.5', 'b.d': u'd', 'l.0.e': '3',
+            'l.0.f.0': 'x', 'l.0.f.1': 'y', 'l.1.e': '4'})
+        copy = loads(Schema, dumps(el))
+        self.assertTrue(isinstance(copy, Schema))
+        self.assertEqual(copy['a'].raw_value, '1')
+        self.assertEqual(copy['a'].value, 1)
+        self.assertEqual(copy.flatten(adapt=False),
+                         el.flatten(adapt=False))
+        self.assertEqual(copy.flatten(), el.flatten())
+        self.assertEqual(copy['l'][0]['f'][1].path, 'l.0.f.1')
+        self.assertIs(copy['b']['c'].parent, copy['b'])
+        self.assertTrue(copy.is_valid())
+
+    def test_does_not_convert_again(self):
+        converter = memoized(int)
+        class Schema(Element):
+            a = Element.with_attrs(converter=converter)
+        data = dumps(Schema.from_flat({'a': '1'}))
+        converter.clear()
+        self.assertEqual(loads(Schema, data)['a'].value, 1)
+        self.assertEqual((converter.hits, converter.misses), (0, 0))
+
+    def test_fingerprint(self):
+        def schema():
+            class Schema(Element):
+                a = Element.with_attrs(converter=int)
+                l = List.of(Element.with_attrs(converter=int))
+            return Schema
+        Schema = schema()
+        self.assertEqual(fingerprint(Schema), fingerprint(schema()))
+        data = dumps(Schema.from_flat({'a': '1', 'l.0': '2'}))
+        Other = schema()
+        Other['g'] = Element
+        self.assertNotEqual(fingerprint(Other), fingerprint(Schema))
+        with self.assertRaises(ValueError):
+            loads(Other, data)
+        with self.assertRaises(ValueError):
+            loads(Schema, 'not binary')
+
+    def test_fingerprint_tells_converters_apart(self):
+        def schema(converter):
+            class Schema(Element):
+                a = Element.with_attrs(converter=staticmethod(converter))
+            return Schema
+        digests = set(fingerprint(schema(converter)) for converter in (
+            lambda value: int(value),
+            lambda value: float(value),
+            memoized(int),
+            memoized(float),
+            vectorized(int, lambda values: map(int, values)),
+            vectorized(int, lambda values: [int(v) for v in values]),
+        ))
+        self.assertEqual(len(digests), 6)
+        self.assertEqual(fingerprint(schema(lambda value: int(value))),
+                         fingerprint(schema(lambda value: int(value))))
+        scale = 2
+        self.assertNotEqual(fingerprint(schema(lambda value: value * scale)),
+                            fingerprint(schema(lambda value: value * 2)))
+        Schema = schema(int)
+        digest = fingerprint(Schema)
+        Schema.converter = staticmethod(float)
+        self.assertNotEqual(fingerprint(Schema), digest)
+        del Schema.converter
+        self.assertEqual(fingerprint(Schema), digest)
+        class Converter(object):
+            def __call__(self, value):
+                return value
+        with self.assertRaises(ValueError):
+            fingerprint(schema(Converter()))
+
+    def test_conversion_errors_are_refused(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+        with self.assertRaises(ValueError):
+            dumps(Schema.from_flat({'a': 'x'}))
+
+    def test_many_records(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+            @List.of
+            class l(Element):
+                e = Element.with_attrs(converter=int)
+                f = List.of(Element)
+        els = [Schema.from_flat({'a': str(i), 'l.0.e': '3', 'l.0.f.0': 'x'})
+               for i in xrange(20)]
+        with tempfile.TemporaryFile() as f:
+            dump_many(Schema, els, f)
+            f.flush()
+            loaded = list(load_many(Schema, f))
+        self.assertEqual([el.flatten() for el in loaded],
+                         [el.flatten() for el in els])
+        with tempfile.TemporaryFile() as f:
+            with self.assertRaises(ValueError):
+                dump_many(Schema, [Element()], f)
+
+
+if __name__ == '__main__':
+    unittest.main()
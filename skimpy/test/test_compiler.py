@@ -0,0 +1,181 @@
+import unittest
+import weakref
+
+from skimpy.element import *
+from skimpy.compiler import *
+
+
+class TestCompileSchema(unittest.TestCase):
+    def test_is_cached_on_class(self):
+        class Schema(Element):
+            a = Element
+        self.assertIs(compile_schema(Schema), compile_schema(Schema))
+
+    def test_is_regenerated_when_schema_changes(self):
+        class Schema(Element):
+            a = Element
+        compiled = compile_schema(Schema)
+        Schema['x'] = Element.with_attrs(name='x')
+        self.assertIsNot(compile_schema(Schema), compiled)
+        self.assertEqual(
+            compile_schema(Schema).from_flat({'x': 1})['x'].value, 1)
+
+    def test_from_flat_matches_generic(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+            class b(Element):
+                c = Element.with_attrs(adapter=str)
+                d = Element
+            @List.of
+            class l(Element):
+                e = Element
+        flat = {'a': '1', 'b': 'b', 'b.c': 2, 'l.0.e': 'e0', 'l.1.e': 'e1'}
+        el = compile_schema(Schema).from_flat(flat)
+        self.assertTrue(isinstance(el, Schema))
+        self.assertEqual(el.flatten(), Schema.from_flat(flat).flatten())
+        self.assertEqual(el['a'].value, 1)
+        self.assertEqual(el['b']['c'].value, 2)
+        self.assertEqual([item['e'].value for item in el['l']], ['e0', 'e1'])
+
+    def test_from_flat_notes_conversion_errors(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+        el = compile_schema(Schema).from_flat({'a': 'x'})
+        self.assertTrue(isinstance(el['a'].conversion_error, ValueError))
+
+    def test_from_flat_can_convert_lazily(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+            @List.of
+            class l(Element):
+                e = Element.with_attrs(converter=int)
+        el = compile_schema(Schema).from_flat({'a': 'x'}, convert='lazy')
+        self.assertNotIn('conversion_error', el['a'].__dict__)
+        self.assertTrue(isinstance(el['a'].conversion_error, ValueError))
+        flat = {'a': '1', 'l.0.e': '2', 'l.1.e': 'x'}
+        self.assertEqual(
+            compile_schema(Schema).from_flat(flat, convert='lazy').flatten(),
+            Schema.from_flat(flat).flatten())
+
+    def test_from_flat_with_weak_parents(self):
+        class Schema(Element):
+            a = Element.with_attrs(weak_parent=True)
+            class b(Element):
+                c = Element
+        el = compile_schema(Schema).from_flat({'a': 1, 'b.c': 2})
+        self.assertTrue(isinstance(el['a'].__dict__['parent'], weakref.ref))
+        self.assertIs(el['a'].parent, el)
+        self.assertIs(el['b'].__dict__['parent'], el)
+
+    def test_from_flat_can_be_strict(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+        with self.assertRaises(ValueError):
+            compile_schema(Schema).from_flat({'a': 'x'}, strict=True)
+
+    def test_from_flat_with_root_name(self):
+        class Schema(Element):
+            name = 'root'
+            a = Element.with_attrs(converter=int)
+        el = compile_schema(Schema).from_flat({'root': 0, 'root.a': '1'})
+        self.assertEqual(el.value, 0)
+        self.assertEqual(el['a'].value, 1)
+
+    def test_flatten_matches_generic(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+            class b(Element):
+                c = Element.with_attrs(adapter=str)
+                d = Element
+            @List.of
+            class l(Element):
+                e = Element
+        flat = {'a': '1', 'b': 'b', 'b.c': 2, 'l.0.e': 'e0', 'l.1.e': 'e1'}
+        compiled = compile_schema(Schema)
+        for kw in [{}, dict(adapt=False), dict(include_empty=True)]:
+            el = Schema.from_flat(flat)
+            self.assertEqual(compiled.flatten(el, **kw), el.flatten(**kw))
+
+    def test_flatten_handles_supplanted_children(self):
+        class Schema(Element):
+            a = Element
+            class b(Element):
+                c = Element
+        el = Schema.from_flat({'a': 1, 'b.c': 2})
+        other = Element.with_attrs(name='other')()
+        other.value = 3
+        el['b'] = other
+        self.assertEqual(compile_schema(Schema).flatten(el), el.flatten())
+        self.assertEqual(el.flatten()['other'], 3)
+
+    def test_flatten_respects_overrides(self):
+        class Custom(Element):
+            def flatten(self, adapt=True, include_empty=False):
+                return {'custom': 1}
+        class Schema(Element):
+            a = Custom
+            b = Element
+        el = Schema.from_flat({'b': 2})
+        self.assertEqual(compile_schema(Schema).flatten(el),
+                         {'custom': 1, 'b': 2})
+        el = Schema.from_flat({'b': 2})
+        el['b'] = Custom()
+        self.assertEqual(compile_schema(Schema).flatten(el)['custom'], 1)
+
+    def test_flatten_of_reparented_root(self):
+        class Schema(Element):
+            a = Element
+            @List.of
+            class l(Element):
+                e = Element
+        el = Schema.from_flat({'a': 1, 'l.0.e': 'e0'})
+        el.name = 'nested'
+        self.assertEqual(compile_schema(Schema).flatten(el), el.flatten())
+
+    def test_is_valid_matches_generic(self):
+        calls = []
+        def validator(el):
+            calls.append(el.path)
+            return el.path != 'b.d'
+        class Schema(Element):
+            validators = [validator]
+            a = Element.with_attrs(validators=[validator])
+            class b(Element):
+                validators = [validator]
+                d = Element.with_attrs(validators=[validator])
+            @List.of
+            class l(Element):
+                validators = [validator]
+                e = Element.with_attrs(validators=[validator])
+        el = Schema.from_flat({'a': '1', 'b.d': 2, 'l.0.e': 'e0'})
+        self.assertFalse(el.is_valid())
+        expected, calls[:] = calls[:], []
+        self.assertFalse(compile_schema(Schema).is_valid(el))
+        self.assertEqual(calls, expected)
+
+    def test_is_valid_records_errors(self):
+        error = TypeError()
+        def validator(el):
+            if el.path == 'a':
+                raise error
+            return True
+        class Schema(Element):
+            validators = [validator]
+            a = Element.with_attrs(validators=[validator])
+            b = Element.with_attrs(validators=[validator])
+        el = Schema.from_flat({'a': '1', 'b': 'b'})
+        self.assertFalse(compile_schema(Schema).is_valid(el))
+        self.assertEqual(el['a'].validation_errors, [error])
+        self.assertEqual(el.validation_errors, [])
+
+    def test_list_schema_uses_generic_methods(self):
+        MyList = List.of(Element.with_attrs(name='l'))
+        compiled = compile_schema(MyList)
+        el = compiled.from_flat({'l.0': 1, 'l.1': 2})
+        self.assertEqual([item.value for item in el], [1, 2])
+        self.assertEqual(compiled.flatten(el), {'l.0': 1, 'l.1': 2})
+        self.assertTrue(compiled.is_valid(el))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
+import gc
+import threading
 import unittest
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from skimpy.element import *
+from skimpy.element import _VALUE, _find_node, _index_flat, _sharing
 
 
 class TestElement(unittest.TestCase):
@@ -14,6 +23,33 @@ class TestElement(unittest.TestCase):
         self.assertIsNot(A['element'], Element)
         self.assertIs(A['element'].parent, A)
 
+    def test_subsequent_gets_return_same_class(self):
+        class A(Element):
+            element = Element
+        self.assertIs(A['element'], A['element'])
+
+    def test_instances_share_bound_child_class(self):
+        class A(Element):
+            element = Element
+        self.assertIs(type(A()['element']), type(A()['element']))
+
+    def test_set_replaces_cached_child(self):
+        class A(Element):
+            element = Element
+        old = A['element']
+        A['element'] = Element.with_attrs(name='element')
+        self.assertIsNot(A['element'], old)
+        self.assertIs(A['element'].parent, A)
+
+    def test_bound_children_do_not_keep_schema_alive(self):
+        class A(Element):
+            element = Element
+        A()['element']
+        ref = weakref.ref(A)
+        del A
+        gc.collect()
+        self.assertIs(ref(), None)
+
     def test_get_on_instance_returns_instance_bound_to_parent_instance(self):
         class A(Element):
             element = Element
@@ -72,6 +108,20 @@ class TestElement(unittest.TestCase):
             name = 'a_name'
         self.assertEqual(MyElement.name, 'a_name')
 
+    def test_properties_compute_attributes(self):
+        class MyElement(Element):
+            @property
+            def name(self):
+                return 'computed'
+            @property
+            def value(self):
+                return 42
+        el = MyElement()
+        self.assertEqual(el.name, 'computed')
+        self.assertEqual(el.path, 'computed')
+        self.assertEqual(el.value, 42)
+        self.assertEqual(MyElement.with_attrs(raw_value='1')().value, 42)
+
     def test_can_set_name_on_instance(self):
         class MyElement(Element):
             pass
@@ -114,6 +164,88 @@ class TestElement(unittest.TestCase):
             e2 = type('E2', (Element,), {'e3': Element})
         self.assertEqual(E1['e2']['e3'].path, 'e2.e3')
 
+    def test_path_follows_name_change(self):
+        class E1(Element):
+            class E2(Element):
+                E3 = Element
+        e1 = E1()
+        e3 = e1['E2']['E3']
+        self.assertEqual(e3.path, 'E2.E3')
+        e1['E2'].name = 'renamed'
+        self.assertEqual(e3.path, 'renamed.E3')
+
+    def test_path_follows_parent_change(self):
+        class E1(Element):
+            class E2(Element):
+                E3 = Element
+        e1 = E1()
+        e3 = e1['E2']['E3']
+        self.assertEqual(e3.path, 'E2.E3')
+        parent = Element()
+        parent.name = 'other'
+        e1['E2'].parent = parent
+        self.assertEqual(e3.path, 'other.E2.E3')
+        del e1['E2'].parent
+        self.assertEqual(e3.path, 'E2.E3')
+
+    def test_path_follows_class_level_name_change(self):
+        class E1(Element):
+            E2 = Element
+        self.assertEqual(E1['E2'].path, 'E2')
+        e1 = E1()
+        self.assertEqual(e1['E2'].path, 'E2')
+        E1.name = 'root'
+        self.assertEqual(E1['E2'].path, 'root.E2')
+        self.assertEqual(e1['E2'].path, 'root.E2')
+        del E1.name
+        self.assertEqual(E1['E2'].path, 'E2')
+        self.assertEqual(e1['E2'].path, 'E2')
+
+    def test_path_of_copy_children(self):
+        class E1(Element):
+            class E2(Element):
+                E3 = Element
+        e1 = E1()
+        self.assertEqual(e1['E2']['E3'].path, 'E2.E3')
+        copy = e1['E2'].copy()
+        copy.name = 'copy'
+        self.assertEqual(copy['E3'].path, 'copy.E3')
+
+    def test_path_of_copy_with_list(self):
+        class E(Element):
+            items = List.of(Element.with_attrs(name='items'))
+        e = E.from_flat({'items.0': 'a'})
+        self.assertEqual(e['items'][0].path, 'items.0')
+        copy = e.copy()
+        copy.name = 'copy'
+        self.assertEqual(copy['items'][0].path, 'copy.items.0')
+        self.assertEqual(copy['items'][0].value, 'a')
+
+    def test_leaves_do_not_allocate_containers(self):
+        class E(Element):
+            a = Element
+        e = E.from_flat({'a': 1})
+        e.is_valid()
+        e.flatten()
+        self.assertNotIn('instances', e['a'].__dict__)
+        self.assertNotIn('validation_errors', e['a'].__dict__)
+        self.assertEqual(e['a'].validation_errors, [])
+        self.assertNotIn('validation_errors', e['a'].__dict__)
+        self.assertEqual(Element.validation_errors, ())
+        self.assertEqual(Element.instances, ())
+        errors = e['a'].validation_errors
+        e['a'].validation_errors.append('first')
+        errors.append('second')
+        self.assertEqual(e['a'].validation_errors, ['first', 'second'])
+
+    def test_validation_errors_are_reset(self):
+        e = Element.with_attrs(validators=[lambda e: e.value])()
+        self.assertFalse(e.is_valid())
+        e.validation_errors.append('error')
+        e.value = 1
+        self.assertTrue(e.is_valid())
+        self.assertEqual(e.validation_errors, [])
+
     def test_can_have_no_children(self):
         self.assertEqual(Element.keys(), [])
 
@@ -311,6 +443,47 @@ class TestElement(unittest.TestCase):
         e.value = 1
         self.assertEqual(e.flatten(adapt=False), {'': 1})
 
+    def test_iterflatten_yields_pairs_depth_first(self):
+        class MyElement(Element):
+            a = Element
+            class b(Element):
+                c = Element
+            d = Element
+        e = MyElement.from_flat({'a': 1, 'b': 2, 'b.c': 3, 'd': 4})
+        pairs = e.iterflatten()
+        self.assertEqual(next(pairs), ('a', 1))
+        self.assertEqual(list(pairs), [('b', 2), ('b.c', 3), ('d', 4)])
+
+    def test_flatten_respects_child_overrides(self):
+        class Custom(Element):
+            def flatten(self, adapt=True, include_empty=False):
+                return {'custom': 1}
+        class Pairs(Element):
+            def iterflatten(self, adapt=True, include_empty=False):
+                yield 'pairs', 2
+        class Schema(Element):
+            a = Custom
+            b = Pairs
+            c = Element
+        el = Schema.from_flat({'c': 3})
+        self.assertEqual(el.flatten(), {'custom': 1, 'pairs': 2, 'c': 3})
+        self.assertEqual(el['a'].flatten(), {'custom': 1})
+
+    def test_iterflatten_adapts_lazily(self):
+        calls = []
+        def adapter(value):
+            calls.append(value)
+            return str(value)
+        class MyElement(Element):
+            a = Element.with_attrs(adapter=staticmethod(adapter))
+            b = Element.with_attrs(adapter=staticmethod(adapter))
+        e = MyElement()
+        e['a'].value = 1
+        e['b'].value = 2
+        pairs = e.iterflatten()
+        self.assertEqual(next(pairs), ('a', '1'))
+        self.assertEqual(calls, [1])
+
     def test_validate_with_no_validators(self):
         e = Element()
         self.assertTrue(e.is_valid())
@@ -400,30 +573,27 @@ class TestListOf(unittest.TestCase):
         el['L'].append(Element())
         self.assertEqual(el['L'][0].path, 'L.0')
 
+    def test_item_paths_follow_index_changes(self):
+        l = List.of(Element).with_attrs(name='l')()
+        l.append(Element())
+        self.assertEqual(l[0].path, 'l.0')
+        l.insert(0, Element())
+        self.assertEqual(l[1].path, 'l.1')
+
     def test_getting_elements_binds_parent_to_instance(self):
         l = List.of(Element)()
         l.append(Element())
         self.assertIs(l[0].parent, l)
 
-    def test_extract_sub_items(self):
-        @List.of
-        class MyElement(Element):
-            name = 'list'
-        flat = dict(('list.%d' % (i,), i) for i in xrange(3))
-        flat['list'] = 3
-        flats = list(MyElement()._extract_sub_items(flat))
-        flats.sort()
-        self.assertEqual(flats, [(i, 'list', i) for i in xrange(3)])
-
-    def test_extract_flats(self):
+    def test_from_flat_orders_items_by_index(self):
         @List.of
         class MyElement(Element):
             name = 'list'
-        flats = list(MyElement()._extract_flats(
-            dict(('list.%d' % (i,), i) for i in xrange(3))))
-        self.assertEqual(flats, [{'list': i} for i in xrange(3)])
+        flat = {'list.10': 'c', 'list.2': 'b', 'list.0': 'a', 'list.x': 'd'}
+        l = MyElement.from_flat(flat)
+        self.assertEqual([el.value for el in l], ['a', 'b', 'c'])
 
-    def test_extract_flats_with_structure(self):
+    def test_from_flat_with_structured_items(self):
         @List.of
         class MyElement(Element):
             name = 'list'
@@ -435,9 +605,9 @@ class TestListOf(unittest.TestCase):
             'list.1.a': 2,
             'list.1.b': 3,
         }
-        flats = list(MyElement()._extract_flats(flat))
-        self.assertEqual(flats, [{'list.a': i, 'list.b': i + 1}
-                                 for i in xrange(0, 4, 2)])
+        l = MyElement.from_flat(flat)
+        self.assertEqual([(el['a'].value, el['b'].value) for el in l],
+                         [(0, 1), (2, 3)])
 
     def test_from_flat(self):
         class MyElement(Element):
@@ -489,6 +659,25 @@ class TestListOf(unittest.TestCase):
         self.assertEqual(el['l'][1]['b']['a'].value, 7)
         self.assertEqual(el['b'].value, 8)
 
+    def test_from_flat_with_nested_lists(self):
+        class Line(Element):
+            sku = Element
+        class Order(Element):
+            lines = List.of(Line)
+        class Doc(Element):
+            orders = List.of(Order)
+        doc = Doc.from_flat({
+            'orders.0.lines.0.sku': 'a',
+            'orders.0.lines.1.sku': 'b',
+            'orders.3.lines.7.sku': 'c',
+            'orders.3.lines.x.sku': 'ignored',
+        })
+        self.assertEqual(
+            [[line['sku'].value for line in order['lines']]
+             for order in doc['orders']],
+            [['a', 'b'], ['c']]
+        )
+
     def test_flatten(self):
         class MyElement(Element):
             @List.of
@@ -575,6 +764,1399 @@ class TestListOf(unittest.TestCase):
         self.assertEqual(l.value, '1')
 
 
+class TestLazyList(unittest.TestCase):
+    def test_items_are_built_on_access(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            @List.of
+            class items(Element):
+                n = Element.with_attrs(converter=staticmethod(converter))
+            items = items.with_attrs(lazy=True)
+        el = Schema.from_flat(dict(
+            ('items.%d.n' % (i,), str(i)) for i in xrange(5)))
+        self.assertEqual(len(el['items']), 5)
+        self.assertEqual(calls, [])
+        self.assertEqual(el['items'][3]['n'].value, 3)
+        self.assertEqual(el['items'][-1]['n'].path, 'items.4.n')
+        self.assertEqual(calls, ['3', '4'])
+
+    def test_whole_list_operations(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            @List.of
+            class items(Element):
+                n = Element.with_attrs(converter=staticmethod(converter))
+            items = items.with_attrs(lazy=True)
+        el = Schema.from_flat({'items.0.n': '0', 'items.1.n': '1'})
+        self.assertEqual(el.flatten(), {'items.0.n': 0, 'items.1.n': 1})
+        self.assertTrue(el.is_valid())
+        self.assertEqual(sorted(calls), ['0', '1'])
+
+    def test_slicing(self):
+        class Schema(Element):
+            items = List.of(Element.with_attrs(converter=int)).with_attrs(
+                lazy=True)
+        el = Schema.from_flat(dict(
+            ('items.%d' % (i,), str(i)) for i in xrange(5)))
+        self.assertEqual([item.value for item in el['items'][1:3]], [1, 2])
+        self.assertEqual([item.value for item in el['items'][::2]],
+                         [0, 2, 4])
+
+    def test_mutation(self):
+        class Schema(Element):
+            @List.of
+            class items(Element):
+                n = Element.with_attrs(converter=int)
+            items = items.with_attrs(lazy=True)
+        el = Schema.from_flat(dict(
+            ('items.%d.n' % (i,), str(i)) for i in xrange(5)))
+        items = el['items']
+        del items[0]
+        self.assertEqual(items[0]['n'].path, 'items.0.n')
+        self.assertEqual(items[0]['n'].value, 1)
+        self.assertEqual(items.pop()['n'].value, 4)
+        items.reverse()
+        self.assertEqual([item['n'].value for item in items], [3, 2, 1])
+
+    def test_pop_only_builds_the_popped_item(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            items = List.of(Element.with_attrs(
+                converter=staticmethod(converter))).with_attrs(lazy=True)
+        el = Schema.from_flat(dict(
+            ('items.%d' % (i,), str(i)) for i in xrange(5)))
+        items = el['items']
+        self.assertEqual(items.pop().value, 4)
+        self.assertEqual(items.pop(1).value, 1)
+        self.assertEqual(calls, ['4', '1'])
+        self.assertEqual([item.value for item in items], [0, 2, 3])
+        self.assertEqual(items[1].path, 'items.1')
+        with self.assertRaises(IndexError):
+            items.pop(5)
+
+    def test_inherited_list_methods_see_items(self):
+        class Schema(Element):
+            items = List.of(Element.with_attrs(name='items')).with_attrs(
+                lazy=True)
+        flat = {'items.0': 'a', 'items.1': 'b'}
+        items = Schema.from_flat(flat)['items']
+        self.assertNotIn('unloaded', repr(items))
+        items = Schema.from_flat(flat)['items']
+        other = Schema.from_flat(flat)['items']
+        self.assertFalse(items == other)
+        for l in (items, other):
+            self.assertTrue(all(isinstance(el, Element)
+                                for el in list.__iter__(l)))
+        items = Schema.from_flat(flat)['items']
+        first = list.__getitem__(items, 0)
+        self.assertNotIn(first, items)
+        self.assertEqual(items.count(first), 0)
+        self.assertIn(items[0], items)
+        items = Schema.from_flat(flat)['items']
+        self.assertEqual([el.value for el in reversed(items)], ['b', 'a'])
+        self.assertEqual([el.value for el in items + []], ['a', 'b'])
+        self.assertEqual(items.index(items[1]), 1)
+
+    def test_from_nested(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            @List.of
+            class items(Element):
+                n = Element.with_attrs(converter=staticmethod(converter))
+            items = items.with_attrs(lazy=True)
+        el = Schema.from_nested({'items': [{'n': '1'}, {'n': '2'}]})
+        self.assertEqual(calls, [])
+        self.assertEqual(el['items'][1]['n'].value, 2)
+        self.assertEqual(calls, ['2'])
+
+    def test_copy(self):
+        class Schema(Element):
+            items = List.of(Element.with_attrs(converter=int)).with_attrs(
+                lazy=True)
+        el = Schema.from_flat({'items.0': '0', 'items.1': '1'})
+        copy = el.copy()
+        copy['items'][0].value = 10
+        self.assertEqual(el['items'][0].value, 0)
+        self.assertEqual(copy['items'][1].value, 1)
+
+
+class TestLazyConversion(unittest.TestCase):
+    def test_converts_on_first_access(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            a = Element.with_attrs(converter=staticmethod(converter))
+            b = Element.with_attrs(converter=staticmethod(converter))
+            c = Element.with_attrs(value=0)
+        el = Schema.from_flat({'a': '1', 'b': '2'}, convert='lazy')
+        self.assertEqual(calls, [])
+        self.assertEqual(el['a'].value, 1)
+        self.assertEqual(el['a'].value, 1)
+        self.assertEqual(calls, ['1'])
+        self.assertEqual(el['c'].value, None)
+        self.assertEqual(el['c'].conversion_error, None)
+        self.assertEqual(el['c'].__class__().value, 0)
+
+    def test_conversion_error_on_access(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+        el = Schema.from_nested({'a': 'x'}, convert='lazy')
+        self.assertTrue(isinstance(el['a'].conversion_error, ValueError))
+        self.assertEqual(el['a'].value, None)
+
+    def test_strict_raises_on_access(self):
+        class Schema(Element):
+            a = Element.with_attrs(converter=int)
+        el = Schema.from_flat({'a': 'x'}, convert='lazy', strict=True)
+        with self.assertRaises(ValueError):
+            el['a'].value
+        with self.assertRaises(ValueError):
+            el['a'].conversion_error
+        with self.assertRaises(ValueError):
+            el.is_valid()
+        el = Schema._compile().from_flat({'a': 'x'}, 'lazy', True)
+        with self.assertRaises(ValueError):
+            el['a'].value
+        el = Schema.from_flat({'a': '1'}, convert='lazy', strict=True)
+        self.assertEqual(el['a'].value, 1)
+
+    def test_assigned_value_is_kept(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            a = Element.with_attrs(converter=staticmethod(converter))
+        el = Schema.from_flat({'a': '1'}, convert='lazy')
+        el['a'].value = 5
+        self.assertEqual(el['a'].conversion_error, None)
+        self.assertEqual(el['a'].value, 5)
+        self.assertEqual(calls, [])
+
+    def test_flatten_and_is_valid_convert_what_they_visit(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            a = Element.with_attrs(converter=staticmethod(converter))
+            b = Element.with_attrs(converter=staticmethod(converter))
+        el = Schema.from_flat({'a': '1', 'b': '2'}, convert='lazy')
+        self.assertTrue(el.is_valid())
+        self.assertEqual(sorted(calls), ['1', '2'])
+        self.assertFalse(el.dirty)
+        el = Schema.from_flat({'a': '1', 'b': '2'}, convert='lazy')
+        self.assertEqual(el.flatten(), {'a': 1, 'b': 2})
+        el = Schema.from_flat({'a': '1', 'b': '2'}, convert='lazy')
+        el['b'].value = 3
+        del calls[:]
+        self.assertTrue(el['b'].is_valid())
+        self.assertEqual(calls, [])
+
+    def test_copies_share_conversions(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        class Schema(Element):
+            a = Element.with_attrs(converter=staticmethod(converter))
+        el = Schema.from_flat({'a': '1'}, convert='lazy')
+        copy = el.copy()
+        self.assertEqual(copy['a'].value, 1)
+        self.assertEqual(el['a'].value, 1)
+        self.assertEqual(calls, ['1'])
+        copy['a'].value = 2
+        self.assertEqual(el['a'].value, 1)
+
+
+class TestCopyOnWrite(unittest.TestCase):
+    def test_copy_shares_children_until_looked_up(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+        e = MyElement.from_flat({'a.b': 1})
+        copy = e.copy()
+        self.assertNotIn('instances', copy.__dict__)
+        self.assertIs(e['a']['b'].parent, e['a'])
+        self.assertEqual(copy.flatten(), e.flatten())
+        self.assertIsNot(copy['a'], e['a'])
+        self.assertIs(copy['a'].parent, copy)
+
+    def test_reads_leave_copy_sharing(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+            l = List.of(Element.with_attrs(name='l'))
+        e = MyElement.from_flat({'a.b': 1, 'l.0': 3, 'l.1': 4})
+        copy = e.copy()
+        self.assertEqual(copy.flatten(), e.flatten())
+        self.assertEqual(copy['l'][1].value, 4)
+        self.assertTrue(copy.is_valid())
+        self.assertIn('_source', copy.__dict__)
+        self.assertFalse(copy.__dict__.get('instances'))
+        self.assertIs(copy['a']['b'].parent, copy['a'])
+        self.assertEqual(copy['l'][0].path, 'l.0')
+
+    def test_looked_up_children_stay_the_same(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+            l = List.of(Element.with_attrs(name='l'))
+        e = MyElement.from_flat({'a.b': 1, 'l.0': 3, 'l.1': 4})
+        copy = e.copy()
+        a = copy['a']
+        self.assertIs(copy['a'], a)
+        a['b'].value = 10
+        self.assertIs(copy.__dict__['instances']['a'], a)
+        self.assertEqual(e['a']['b'].value, 1)
+        item = copy['l'][1]
+        copy['l'][1].value = 40
+        self.assertEqual(item.value, 40)
+        self.assertEqual(e['l'][1].value, 4)
+
+    def test_dropped_copies_stop_sharing(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+        gc.collect()
+        before = len(_sharing)
+        e = MyElement.from_flat({'a.b': 1})
+        for i in xrange(10):
+            e['a'] = MyElement.from_flat({'a.b': i})['a']
+            e.copy().flatten()
+        gc.collect()
+        self.assertEqual(len(_sharing), before + 1)
+        del e
+        gc.collect()
+        self.assertEqual(len(_sharing), before)
+
+    def test_writes_to_source_do_not_show_in_copy(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+                c = Element
+            l = List.of(Element.with_attrs(name='l'))
+        e = MyElement.from_flat({'a.b': 1, 'a.c': 2, 'l.0': 3, 'l.1': 4})
+        copy = e.copy()
+        e['a']['b'].value = 10
+        e['l'][0].value = 30
+        e['l'].append_new().value = 5
+        self.assertEqual(copy.flatten(),
+                         {'a.b': 1, 'a.c': 2, 'l.0': 3, 'l.1': 4})
+
+    def test_writes_to_copy_do_not_show_in_source(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+                c = Element
+            l = List.of(Element.with_attrs(name='l'))
+        e = MyElement.from_flat({'a.b': 1, 'a.c': 2, 'l.0': 3, 'l.1': 4})
+        copy = e.copy()
+        copy['a']['b'].value = 10
+        copy['l'][1].value = 40
+        del copy['l'][0]
+        self.assertEqual(e.flatten(),
+                         {'a.b': 1, 'a.c': 2, 'l.0': 3, 'l.1': 4})
+        self.assertEqual(copy.flatten(), {'a.b': 10, 'a.c': 2, 'l.0': 40})
+
+    def test_list_copy_keeps_length(self):
+        class MyElement(Element):
+            l = List.of(Element.with_attrs(name='l'))
+        e = MyElement.from_flat({'l.0': 3, 'l.1': 4})
+        copy = e['l'].copy()
+        self.assertEqual(len(copy), 2)
+        e['l'][0].value = 30
+        self.assertEqual([item.value for item in copy], [3, 4])
+        self.assertEqual([item.path for item in copy], ['l.0', 'l.1'])
+
+    def test_copy_of_copy(self):
+        class MyElement(Element):
+            class a(Element):
+                c = Element
+        e = MyElement.from_flat({'a.c': 2})
+        copy = e.copy()
+        copy2 = copy.copy()
+        e['a']['c'].value = 20
+        copy['a']['c'].value = 21
+        self.assertEqual(copy2['a']['c'].value, 2)
+
+    def test_setitem_shares_subtree(self):
+        class MyElement(Element):
+            class a(Element):
+                b = Element
+        e = MyElement.from_flat({'a.b': 1})
+        other = MyElement.from_flat({'a.b': 2})
+        other['a'] = e['a']
+        self.assertIs(e['a']['b'].parent, e['a'])
+        e['a']['b'].value = 10
+        self.assertEqual(other['a']['b'].value, 1)
+        self.assertEqual(other['a']['b'].path, 'a.b')
+
+
+class TestIncrementalValidation(unittest.TestCase):
+    def test_elements_start_dirty(self):
+        class MyElement(Element):
+            class b(Element):
+                c = Element
+        e = MyElement.from_flat({'b.c': 3})
+        self.assertTrue(e.dirty)
+        self.assertTrue(e['b']['c'].dirty)
+
+    def test_validation_cleans_elements(self):
+        class MyElement(Element):
+            @List.of
+            class l(Element):
+                a = Element
+        e = MyElement.from_flat({'l.0.a': 1, 'l.1.a': 2})
+        self.assertTrue(e.is_valid())
+        self.assertFalse(e.dirty)
+        self.assertFalse(e['l'][1]['a'].dirty)
+
+    def test_value_change_dirties_ancestors_only(self):
+        class MyElement(Element):
+            l = List.of(Element)
+            class b(Element):
+                c = Element
+        e = MyElement.from_flat({'l.0': 1, 'b.c': 3})
+        e.is_valid()
+        e['b']['c'].value = 4
+        self.assertTrue(e['b']['c'].dirty)
+        self.assertTrue(e['b'].dirty)
+        self.assertTrue(e.dirty)
+        self.assertFalse(e['l'].dirty)
+
+    def test_incremental_only_visits_dirty_subtrees(self):
+        calls = []
+        def validator(el):
+            calls.append(el.path)
+            return el.value != 'bad'
+        class MyElement(Element):
+            validators = [validator]
+            l = List.of(Element.with_attrs(validators=[validator]))
+            class b(Element):
+                validators = [validator]
+                c = Element.with_attrs(validators=[validator])
+        e = MyElement.from_flat({'l.0': 1, 'b.c': 3})
+        e.is_valid()
+        del calls[:]
+        e['b']['c'].value = 'bad'
+        self.assertFalse(e.is_valid(incremental=True))
+        self.assertEqual(calls, ['b.c', 'b', ''])
+        del calls[:]
+        self.assertFalse(e.is_valid(incremental=True))
+        self.assertEqual(calls, [])
+        e['b']['c'].raw_value = 'ok'
+        e['b']['c'].convert()
+        self.assertTrue(e.is_valid(incremental=True))
+        self.assertEqual(calls, ['b.c', 'b', ''])
+
+    def test_conversion_errors_dirty(self):
+        def converted(el):
+            return el.conversion_error is None
+        class MyElement(Element):
+            a = Element.with_attrs(converter=int, validators=[converted])
+            b = Element.with_attrs(converter=int, validators=[converted])
+        e = MyElement.from_flat({'a': '1', 'b': '2'})
+        self.assertTrue(e.is_valid())
+        e['a'].conversion_error = ValueError()
+        self.assertTrue(e.dirty)
+        self.assertFalse(e.is_valid(incremental=True))
+        e = MyElement.from_flat({'a': '1', 'b': '2'})
+        e['b'].raw_value = 'x'
+        self.assertTrue(e.is_valid())
+        e['b'].convert(strict=False)
+        self.assertTrue(e.dirty)
+        self.assertFalse(e.is_valid(incremental=True))
+
+    def test_cached_results_keep_errors(self):
+        calls = []
+        def validator(el):
+            calls.append(el.path)
+            return el.value != 'bad'
+        class MyElement(Element):
+            validators = [validator]
+            l = List.of(Element.with_attrs(validators=[validator]))
+            class b(Element):
+                validators = [validator]
+                c = Element.with_attrs(validators=[validator])
+        e = MyElement.from_flat({'l.0': 'bad', 'b.c': 3})
+        self.assertFalse(e.is_valid())
+        e['b']['c'].value = 5
+        self.assertFalse(e.is_valid(incremental=True))
+        self.assertEqual(calls[-3:], ['b.c', 'b', ''])
+
+    def test_list_mutation_dirties_list(self):
+        calls = []
+        def validator(el):
+            calls.append(el.path)
+            return True
+        class MyElement(Element):
+            validators = [validator]
+            @List.of
+            class l(Element):
+                validators = [validator]
+                a = Element.with_attrs(validators=[validator])
+            l = l.with_attrs(validators=[validator])
+            b = Element.with_attrs(validators=[validator])
+        e = MyElement.from_flat({'l.0.a': 1, 'l.1.a': 2, 'b': 3})
+        e.is_valid()
+        e['l'].append(e['l'].element_type())
+        self.assertTrue(e['l'].dirty)
+        self.assertTrue(e.dirty)
+        del calls[:]
+        e.is_valid(incremental=True)
+        self.assertEqual(calls, ['l.2.a', 'l.2', 'l', ''])
+
+    def test_removing_list_items_revalidates_shifted_items(self):
+        calls = []
+        def validator(el):
+            calls.append(el.path)
+            return True
+        class MyElement(Element):
+            validators = [validator]
+            @List.of
+            class l(Element):
+                validators = [validator]
+                a = Element.with_attrs(validators=[validator])
+            l = l.with_attrs(validators=[validator])
+        e = MyElement.from_flat({'l.0.a': 1, 'l.1.a': 2})
+        e.is_valid()
+        del e['l'][0]
+        del calls[:]
+        e.is_valid(incremental=True)
+        self.assertEqual(calls, ['l.0', 'l', ''])
+
+    def test_setitem_dirties_parent(self):
+        class MyElement(Element):
+            class b(Element):
+                c = Element
+        e = MyElement.from_flat({'b.c': 3})
+        e.is_valid()
+        e['b'] = e['b']
+        self.assertTrue(e.dirty)
+
+    def test_adapting_does_not_dirty(self):
+        class MyElement(Element):
+            a = Element.with_attrs(adapter=str)
+            l = List.of(Element.with_attrs(adapter=str))
+        e = MyElement.from_flat({'a': 1, 'l.0': 2})
+        e.is_valid()
+        e.flatten()
+        self.assertFalse(e.dirty)
+
+
+class TestFlattenChanges(unittest.TestCase):
+    def test_without_checkpoint_everything_changed(self):
+        e = Element.with_attrs(name='x')()
+        e.value = 1
+        self.assertEqual(e.flatten_changes(), ({'x': 1}, set()))
+
+    def test_no_changes(self):
+        adapted = []
+        def adapter(value):
+            adapted.append(value)
+            return str(value)
+        class MyElement(Element):
+            a = Element.with_attrs(adapter=staticmethod(adapter))
+            l = List.of(Element.with_attrs(adapter=staticmethod(adapter)))
+        e = MyElement.from_flat({'a': 1, 'l.0': 10})
+        e.checkpoint()
+        self.assertEqual(e.flatten_changes(), ({}, set()))
+        self.assertEqual(adapted, [])
+
+    def test_only_changed_leaves_are_adapted(self):
+        adapted = []
+        def adapter(value):
+            adapted.append(value)
+            return str(value)
+        class MyElement(Element):
+            a = Element.with_attrs(adapter=staticmethod(adapter))
+            b = Element.with_attrs(adapter=staticmethod(adapter))
+        e = MyElement.from_flat({'a': 1, 'b': 10})
+        e.checkpoint()
+        e['a'].value = 2
+        self.assertEqual(e.flatten_changes(), ({'a': '2'}, set()))
+        self.assertEqual(adapted, [2])
+        self.assertEqual(e.flatten_changes(adapt=False), ({'a': 2}, set()))
+
+    def test_list_removal_shifts_indexes(self):
+        class MyElement(Element):
+            l = List.of(Element.with_attrs(adapter=str))
+        e = MyElement.from_flat({'l.0': 10, 'l.1': 11, 'l.2': 12})
+        e.checkpoint()
+        del e['l'][0]
+        self.assertEqual(e.flatten_changes(),
+                         ({'l.0': '11', 'l.1': '12'}, set(['l.2'])))
+
+    def test_cleared_values_are_removed(self):
+        class MyElement(Element):
+            a = Element.with_attrs(adapter=str)
+        e = MyElement.from_flat({'a': 1})
+        e.checkpoint()
+        e['a'].value = None
+        self.assertEqual(e.flatten_changes(), ({}, set(['a'])))
+        self.assertEqual(e.flatten_changes(False, include_empty=True),
+                         ({'a': None}, set()))
+
+    def test_checkpoint_resets_changes(self):
+        class MyElement(Element):
+            l = List.of(Element.with_attrs(adapter=str))
+        e = MyElement.from_flat({'l.0': 10, 'l.1': 11, 'l.2': 12})
+        e.checkpoint()
+        e['l'].append_new().value = 13
+        self.assertEqual(e.flatten_changes(), ({'l.3': '13'}, set()))
+        e.checkpoint()
+        self.assertEqual(e.flatten_changes(), ({}, set()))
+
+
+class TestAsyncIsValid(unittest.TestCase):
+    def test_children_are_validated_before_parents(self):
+        done = []
+        lock = threading.Lock()
+        def validator(el):
+            with lock:
+                for child in el._iterchildren():
+                    if not any(child is other for other in done):
+                        return False
+                done.append(el)
+            return True
+        class MyElement(Element):
+            validators = [validator]
+            @List.of
+            class a(Element):
+                validators = [validator]
+                b = Element.with_attrs(validators=[validator])
+                c = Element.with_attrs(validators=[validator])
+            a = a.with_attrs(validators=[validator])
+            d = Element.with_attrs(validators=[validator])
+        e = MyElement()
+        e['a'].extend(e['a'].element_type() for _ in xrange(3))
+        self.assertTrue(e.async_is_valid())
+        self.assertEqual(len(done), 12)
+
+    def test_independent_subtrees_run_concurrently(self):
+        started = threading.Event()
+        def validator(el):
+            if el.path == 'a.b':
+                started.set()
+            elif el.path == 'd':
+                return started.wait(5) or started.is_set()
+            return True
+        class MyElement(Element):
+            class a(Element):
+                b = Element.with_attrs(validators=[validator])
+            d = Element.with_attrs(validators=[validator])
+        self.assertTrue(MyElement().async_is_valid(max_concurrency=2))
+
+    def test_concurrency_is_bounded(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+        overlapped = threading.Event()
+        def validator(el):
+            with lock:
+                active.append(el)
+                peak.append(len(active))
+                if len(active) == 2:
+                    overlapped.set()
+            # The first validator waits for a second one to start.
+            overlapped.wait(5)
+            with lock:
+                active.remove(el)
+            return True
+        class MyElement(Element):
+            l = List.of(Element.with_attrs(validators=[validator]))
+        e = MyElement()
+        e['l'].extend(e['l'].element_type() for _ in xrange(4))
+        self.assertTrue(e.async_is_valid(max_concurrency=2))
+        self.assertTrue(overlapped.is_set())
+        self.assertTrue(max(peak) <= 2)
+
+    def test_stores_results_like_is_valid(self):
+        def validator(el):
+            return el.value != 'bad'
+        class MyElement(Element):
+            a = Element.with_attrs(validators=[validator])
+            @List.of
+            class l(Element):
+                b = Element.with_attrs(validators=[validator])
+        e = MyElement.from_flat({'a': 'ok', 'l.0.b': 'ok', 'l.1.b': 'bad'})
+        self.assertFalse(e.async_is_valid())
+        self.assertFalse(e.dirty)
+        self.assertFalse(e['l'][0].dirty)
+        self.assertFalse(e['l'].is_valid(incremental=True))
+        self.assertTrue(e['l'][0].is_valid(incremental=True))
+        self.assertTrue(e['a'].is_valid(incremental=True))
+        e['l'][1]['b'].value = 'ok'
+        self.assertTrue(e.is_valid(incremental=True))
+
+    def test_matches_is_valid(self):
+        error = TypeError()
+        def validator(el):
+            if el.path == 'a.1.c':
+                raise error
+            if el.path == 'd':
+                el.validation_errors.append('d')
+                return False
+            return True
+        class MyElement(Element):
+            @List.of
+            class a(Element):
+                c = Element.with_attrs(validators=[validator])
+            d = Element.with_attrs(validators=[validator])
+        e = MyElement()
+        e['a'].extend(e['a'].element_type() for _ in xrange(2))
+        self.assertFalse(e.async_is_valid())
+        self.assertEqual(e['a'][1]['c'].validation_errors, [error])
+        self.assertEqual(e['d'].validation_errors, ['d'])
+        self.assertEqual(e['a'][0]['c'].validation_errors, [])
+
+    def test_reraises_unexpected_exceptions(self):
+        def validator(el):
+            raise KeyboardInterrupt
+        class MyElement(Element):
+            a = Element
+            d = Element.with_attrs(validators=[validator])
+        with self.assertRaises(KeyboardInterrupt):
+            MyElement().async_is_valid()
+
+
+class TestBatch(unittest.TestCase):
+    def test_from_flat_many(self):
+        class MyElement(Element):
+            a = Element.with_attrs(converter=int)
+            class b(Element):
+                c = Element
+            l = List.of(Element)
+        flats = [{'a': str(i), 'b.c': i, 'l.0': i} for i in xrange(3)]
+        els = MyElement.from_flat_many(iter(flats))
+        self.assertEqual(next(els)['a'].value, 0)
+        self.assertEqual(
+            [(el['a'].value, el['b']['c'].value, el['l'][0].value)
+             for el in els],
+            [(1, 1, 1), (2, 2, 2)]
+        )
+
+    def test_flatten_many(self):
+        class MyElement(Element):
+            a = Element.with_attrs(converter=int)
+            class b(Element):
+                c = Element
+            l = List.of(Element)
+        flats = [{'a': str(i), 'b.c': i, 'l.0': i} for i in xrange(3)]
+        els = list(MyElement.from_flat_many(flats, convert=False))
+        self.assertEqual(list(MyElement.flatten_many(els, adapt=False)),
+                         [el.flatten(adapt=False) for el in els])
+
+    def test_validate_many(self):
+        class MyElement(Element):
+            a = Element.with_attrs(converter=int)
+            b = Element
+        els = list(MyElement.from_flat_many([{'a': '1'}, {'a': 'x'}]))
+        els[1]['b'].validators = [lambda el: False]
+        self.assertEqual(list(MyElement.validate_many(els)), [True, False])
+
+
+class TestColumnarConversion(unittest.TestCase):
+    def test_converts_each_column_once(self):
+        columns = []
+        def convert_column(values):
+            columns.append(values)
+            return [int(value) for value in values]
+        converter = vectorized(int, convert_column)
+        class MyElement(Element):
+            n = Element.with_attrs(converter=converter)
+            @List.of
+            class items(Element):
+                n = Element.with_attrs(converter=converter)
+        els = list(MyElement.from_flat_many([
+            {'n': '1', 'items.0.n': '2', 'items.1.n': '3'},
+            {'n': '4', 'items.0.n': '5'},
+        ], columnar=True))
+        self.assertEqual(sorted(columns), [['1', '4'], ['2', '3', '5']])
+        self.assertEqual([el['n'].value for el in els], [1, 4])
+        self.assertEqual([[item['n'].value for item in el['items']]
+                          for el in els], [[2, 3], [5]])
+
+    def test_failed_column_falls_back_to_each_value(self):
+        class MyElement(Element):
+            n = Element.with_attrs(converter=vectorized(
+                int, lambda values: [int(value) for value in values]))
+        els = list(MyElement.from_flat_many(
+            [{'n': '1'}, {'n': 'x'}, {'n': '3'}], columnar=True))
+        self.assertEqual([el['n'].value for el in els], [1, None, 3])
+        self.assertEqual([el['n'].conversion_error for el in els][::2],
+                         [None, None])
+        self.assertTrue(isinstance(els[1]['n'].conversion_error, ValueError))
+
+    def test_missing_values_are_converted_one_by_one(self):
+        columns = []
+        def convert_column(values):
+            columns.append(values)
+            return [int(value) for value in values]
+        class MyElement(Element):
+            n = Element.with_attrs(converter=vectorized(int, convert_column))
+        els = list(MyElement.from_flat_many([{'n': '1'}, {}],
+                                            columnar=True))
+        self.assertEqual(columns, [['1']])
+        self.assertTrue(isinstance(els[1]['n'].conversion_error, TypeError))
+
+    def test_strict_raises(self):
+        class MyElement(Element):
+            n = Element.with_attrs(converter=vectorized(
+                int, lambda values: [int(value) for value in values]))
+        with self.assertRaises(ValueError):
+            MyElement.from_flat_many([{'n': 'x'}], strict=True,
+                                     columnar=True)
+
+    def test_plain_converters_are_called_per_value(self):
+        class MyElement(Element):
+            n = Element.with_attrs(converter=int)
+        els = list(MyElement.from_flat_many([{'n': '1'}, {'n': '2'}],
+                                            columnar=True))
+        self.assertEqual([el['n'].value for el in els], [1, 2])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_converter(self):
+        class MyElement(Element):
+            n = Element.with_attrs(converter=numpy_converter(float))
+        els = list(MyElement.from_flat_many([{'n': '1.5'}, {'n': 'x'}],
+                                            columnar=True))
+        self.assertEqual(els[0]['n'].value, 1.5)
+        self.assertTrue(isinstance(els[1]['n'].conversion_error, ValueError))
+
+
+class TestMemoized(unittest.TestCase):
+    def test_repeated_values_are_converted_once(self):
+        calls = []
+        def converter(value):
+            calls.append(value)
+            return int(value)
+        MyElement = Element.with_attrs(converter=memoized(converter))
+        values = [MyElement.from_flat({'': raw}).value
+                  for raw in ['1', '2', '1', '1']]
+        self.assertEqual(values, [1, 2, 1, 1])
+        self.assertEqual(calls, ['1', '2'])
+        self.assertEqual((MyElement.converter.hits,
+                          MyElement.converter.misses), (2, 2))
+
+    def test_failures_are_cached(self):
+        converter = memoized(int)
+        MyElement = Element.with_attrs(converter=converter)
+        errors = [MyElement.from_flat({'': 'x'}).conversion_error
+                  for _ in xrange(2)]
+        self.assertTrue(isinstance(errors[0], ValueError))
+        self.assertIs(errors[0], errors[1])
+        self.assertEqual(converter.hits, 1)
+
+    def test_adapters(self):
+        MyElement = Element.with_attrs(adapter=memoized(str))
+        el = MyElement()
+        el.value = 1
+        self.assertEqual(el.flatten(), {'': '1'})
+        el.value = True
+        self.assertEqual(el.flatten(), {'': 'True'})
+
+    def test_eviction_keeps_recently_used_values(self):
+        calls = []
+        def func(value):
+            calls.append(value)
+            return value
+        cache = memoized(func, maxsize=2)
+        for value in [1, 2, 3, 1, 4, 5, 1, 2]:
+            cache(value)
+        self.assertEqual(calls, [1, 2, 3, 4, 5, 2])
+
+    def test_unhashable_values_are_not_cached(self):
+        cache = memoized(len)
+        self.assertEqual(cache([1, 2]), 2)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_clear(self):
+        cache = memoized(int)
+        cache('1')
+        cache.clear()
+        cache('1')
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+
+class TestPathAccess(unittest.TestCase):
+    def test_get_path(self):
+        class Schema(Element):
+            @List.of
+            class orders(Element):
+                lines = List.of(Element.with_attrs(name='lines'))
+            class a(Element):
+                b = Element
+        el = Schema.from_flat({
+            'orders.0.lines.0': 'x', 'orders.1.lines.0': 'y',
+            'orders.1.lines.1': 'z', 'a.b': 1})
+        self.assertEqual(el.get_path('orders.1.lines.1').value, 'z')
+        self.assertIs(el.get_path('orders.1'), el['orders'][1])
+        self.assertEqual(el.get_path('a.b').value, 1)
+        self.assertIs(el.get_path(''), el)
+
+    def test_get_path_errors(self):
+        class Schema(Element):
+            @List.of
+            class orders(Element):
+                lines = List.of(Element.with_attrs(name='lines'))
+            class a(Element):
+                b = Element
+        el = Schema()
+        with self.assertRaises(IndexError):
+            el.get_path('orders.0.lines')
+        with self.assertRaises(KeyError):
+            el.get_path('a.bogus')
+        with self.assertRaises(KeyError):
+            el.get_path('orders.bogus')
+
+    def test_set_path(self):
+        class Schema(Element):
+            @List.of
+            class orders(Element):
+                sku = Element
+            class a(Element):
+                b = Element
+        el = Schema.from_flat({'orders.0.sku': 'x'})
+        el.set_path('orders.0.sku', 'y')
+        el.set_path('a.b', 2)
+        self.assertEqual(el.flatten(), {'orders.0.sku': 'y', 'a.b': 2})
+
+    def test_get_path_on_class(self):
+        class Schema(Element):
+            @List.of
+            class orders(Element):
+                @List.of
+                class lines(Element):
+                    sku = Element
+            class a(Element):
+                b = Element
+        self.assertIs(Schema.get_path('a.b'), Schema['a']['b'])
+        sku = Schema.get_path('orders.3.lines.0.sku')
+        self.assertIs(sku, Schema.get_path('orders.3.lines.0.sku'))
+        self.assertEqual(sku.path, 'orders.3.lines.0.sku')
+        self.assertTrue(issubclass(
+            Schema.get_path('orders.3'), Schema['orders'].element_type))
+        with self.assertRaises(KeyError):
+            Schema.get_path('orders.bogus')
+
+
+def parse_events(data):
+    # The events ijson.basic_parse would produce for data.
+    if isinstance(data, dict):
+        yield 'start_map', None
+        for key, value in sorted(data.iteritems()):
+            yield 'map_key', key
+            for event in parse_events(value):
+                yield event
+        yield 'end_map', None
+    elif isinstance(data, list):
+        yield 'start_array', None
+        for value in data:
+            for event in parse_events(value):
+                yield event
+        yield 'end_array', None
+    elif data is None:
+        yield 'null', None
+    elif isinstance(data, bool):
+        yield 'boolean', data
+    elif isinstance(data, (int, float)):
+        yield 'number', data
+    else:
+        yield 'string', data
+
+
+class TestNested(unittest.TestCase):
+    def test_from_nested(self):
+        class Schema(Element):
+            id = Element
+            @List.of
+            class lines(Element):
+                sku = Element
+                qty = Element.with_attrs(converter=int)
+            tags = List.of(Element.with_attrs(name='tags'))
+            meta = Element
+        el = Schema.from_nested({
+            'id': 'o1',
+            'lines': [{'sku': 'a', 'qty': '1'}, {'sku': 'b', 'qty': 'x'}],
+            'tags': ['t1', None, 't3'],
+            'meta': {'raw': [1, 2]},
+            'bogus': {'x': 1},
+        })
+        self.assertEqual(el['id'].value, 'o1')
+        self.assertEqual(el['lines'][0]['qty'].value, 1)
+        self.assertTrue(isinstance(el['lines'][1]['qty'].conversion_error,
+                                   ValueError))
+        self.assertEqual([tag.value for tag in el['tags']],
+                         ['t1', None, 't3'])
+        self.assertEqual(el['meta'].value, {'raw': [1, 2]})
+        self.assertEqual(el.flatten(), {
+            'id': 'o1', 'lines.0.sku': 'a', 'lines.0.qty': 1,
+            'lines.1.sku': 'b', 'tags.0': 't1', 'tags.2': 't3',
+            'meta': {'raw': [1, 2]}})
+
+    def test_from_events(self):
+        class Schema(Element):
+            id = Element
+            @List.of
+            class lines(Element):
+                qty = Element.with_attrs(converter=int)
+            tags = List.of(Element.with_attrs(name='tags'))
+            meta = Element
+        nested = {
+            'id': 'o1',
+            'lines': [{'qty': '1'}, {'qty': 'x'}],
+            'tags': ['t1', None, 't3'],
+            'meta': {'raw': [1, 2]},
+            'bogus': {'x': 1},
+        }
+        el = Schema.from_events(parse_events(nested))
+        self.assertEqual(el.flatten(), Schema.from_nested(nested).flatten())
+        self.assertTrue(isinstance(el['lines'][1]['qty'].conversion_error,
+                                   ValueError))
+        self.assertEqual([tag.value for tag in el['tags']],
+                         ['t1', None, 't3'])
+        self.assertEqual(el['meta'].value, {'raw': [1, 2]})
+
+    def test_from_events_leaves_no_event_unread(self):
+        class Schema(Element):
+            id = Element
+            tags = List.of(Element.with_attrs(name='tags'))
+        events = parse_events([
+            {'id': 'o1', 'tags': ['t1'], 'bogus': {'x': [1]}}, 'next'])
+        next(events)
+        Schema.from_events(events)
+        self.assertEqual(list(events), [('string', 'next'),
+                                        ('end_array', None)])
+
+    def test_from_nested_matches_from_flat(self):
+        class Schema(Element):
+            id = Element
+            @List.of
+            class lines(Element):
+                qty = Element.with_attrs(converter=int)
+            tags = List.of(Element.with_attrs(name='tags'))
+        flat = {'id': 'x', 'lines.0.qty': '2', 'tags.0': 'y'}
+        nested = {'id': 'x', 'lines': [{'qty': '2'}], 'tags': ['y']}
+        self.assertEqual(Schema.from_nested(nested).flatten(),
+                         Schema.from_flat(flat).flatten())
+
+    def test_to_nested(self):
+        class Schema(Element):
+            id = Element
+            @List.of
+            class lines(Element):
+                sku = Element
+                qty = Element.with_attrs(converter=int)
+            tags = List.of(Element.with_attrs(name='tags'))
+            meta = Element
+        el = Schema.from_nested({
+            'id': 'o1',
+            'lines': [{'sku': 'a', 'qty': '1'}, {'sku': 'b', 'qty': 'x'}],
+            'tags': ['t1', None, 't3'],
+            'meta': {'raw': [1, 2]},
+        })
+        self.assertEqual(el.to_nested(), {
+            'id': 'o1',
+            'lines': [{'sku': 'a', 'qty': 1}, {'sku': 'b'}],
+            'tags': ['t1', None, 't3'],
+            'meta': {'raw': [1, 2]}})
+        self.assertEqual(Schema().to_nested(), None)
+
+    def test_to_nested_round_trips(self):
+        class Schema(Element):
+            @List.of
+            class lines(Element):
+                sku = Element
+                qty = Element.with_attrs(converter=int)
+            tags = List.of(Element.with_attrs(name='tags'))
+        nested = Schema.from_nested({
+            'lines': [{'sku': 'a', 'qty': '1'}, {'qty': 'x'}],
+            'tags': ['t1', None],
+        }).to_nested()
+        self.assertEqual(Schema.from_nested(nested).to_nested(), nested)
+
+    def test_to_nested_adapts(self):
+        el = Element.with_attrs(adapter=str)()
+        el.value = 1
+        self.assertEqual(el.to_nested(), '1')
+        self.assertEqual(el.to_nested(adapt=False), 1)
+
+
+class TestFromUrlencoded(unittest.TestCase):
+    def test_routes_pairs_to_elements(self):
+        class Schema(Element):
+            q = Element
+            @List.of
+            class items(Element):
+                sku = Element
+                qty = Element.with_attrs(converter=int)
+        el = Schema.from_urlencoded(
+            'q=a+b%26c&items.1.sku=%C3%A9&items.0.qty=2&items.0.sku=x&junk')
+        self.assertEqual(el.flatten(), {
+            'q': u'a b&c', 'items.0.sku': u'x', 'items.0.qty': 2,
+            'items.1.sku': u'\xe9'})
+
+    def test_accepts_buffers(self):
+        class Schema(Element):
+            q = Element
+            items = List.of(Element.with_attrs(name='items'))
+        body = 'q=a+b%26c&items.1=%C3%A9&items.0=x'
+        expected = Schema.from_urlencoded(body).flatten()
+        for data in (bytearray(body), memoryview(body), buffer(body)):
+            self.assertEqual(Schema.from_urlencoded(data).flatten(),
+                             expected)
+
+    def test_without_encoding_values_stay_bytes(self):
+        class Schema(Element):
+            q = Element
+            items = List.of(Element.with_attrs(name='items'))
+        el = Schema.from_urlencoded('q=a&items.1=%C3%A9&items.0=x',
+                                    encoding=None)
+        self.assertEqual(el['items'][1].value, '\xc3\xa9')
+        self.assertTrue(isinstance(el['q'].value, str))
+
+    def test_unused_values_are_not_decoded(self):
+        class Schema(Element):
+            q = Element
+        el = Schema.from_urlencoded('q=1&bogus=%FF', encoding='ascii')
+        self.assertEqual(el['q'].value, u'1')
+
+    def test_conversion(self):
+        class Schema(Element):
+            @List.of
+            class items(Element):
+                qty = Element.with_attrs(converter=int)
+        el = Schema.from_urlencoded('items.0.qty=x')
+        self.assertTrue(isinstance(el['items'][0]['qty'].conversion_error,
+                                   ValueError))
+        with self.assertRaises(ValueError):
+            Schema.from_urlencoded('items.0.qty=x', strict=True)
+
+    def test_undecodable_values_are_conversion_errors(self):
+        class Schema(Element):
+            q = Element
+            n = Element.with_attrs(converter=int)
+        el = Schema.from_urlencoded('q=%FF&n=1')
+        self.assertTrue(isinstance(el['q'].conversion_error,
+                                   UnicodeDecodeError))
+        self.assertEqual(el['q'].raw_value, '\xff')
+        self.assertEqual(el['q'].value, None)
+        self.assertEqual(el['n'].value, 1)
+        el = Schema.from_urlencoded('q=%FF', convert='lazy')
+        self.assertTrue(isinstance(el['q'].conversion_error,
+                                   UnicodeDecodeError))
+        self.assertEqual(Schema.from_urlencoded('%FF=1&n=2').flatten(),
+                         {'n': 2})
+        with self.assertRaises(UnicodeDecodeError):
+            Schema.from_urlencoded('q=%FF', strict=True)
+
+    def test_with_root_name(self):
+        class Schema(Element):
+            name = 'form'
+            q = Element
+        el = Schema.from_urlencoded('form.q=1&q=2')
+        self.assertEqual(el['q'].value, u'1')
+
+
+class TestIndexFlat(unittest.TestCase):
+    def test_splits_keys_into_nested_nodes(self):
+        index = _index_flat({'a': 1, 'a.b': 2, 'a.c.d': 3})
+        self.assertEqual(index, {
+            'a': {_VALUE: 1, 'b': {_VALUE: 2}, 'c': {'d': {_VALUE: 3}}},
+        })
+
+    def test_empty_key_is_root_value(self):
+        self.assertEqual(_index_flat({'': 1}), {_VALUE: 1})
+
+    def test_find_node(self):
+        index = _index_flat({'a.b.c': 1})
+        self.assertIs(_find_node(index, ''), index)
+        self.assertEqual(_find_node(index, 'a.b'), {'c': {_VALUE: 1}})
+        self.assertIs(_find_node(index, 'a.x.c'), None)
+
+
+class TestWeakParent(unittest.TestCase):
+    def test_trees_are_freed_without_collection(self):
+        class Schema(Element):
+            a = Element.with_attrs(weak_parent=True)
+            @List.of
+            class l(Element):
+                weak_parent = True
+                c = Element.with_attrs(weak_parent=True)
+            l = l.with_attrs(weak_parent=True)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            el = Schema.from_flat({'a': 1, 'l.0.c': 2, 'l.1.c': 3})
+            el.is_valid()
+            el.flatten()
+            copy = el.copy()
+            copy['l'][1]['c'].value = 4
+            refs = map(weakref.ref, el._iterdescendants())
+            refs += map(weakref.ref, copy._iterdescendants())
+            del el, copy
+            self.assertEqual([r for r in refs if r() is not None], [])
+        finally:
+            if enabled:
+                gc.enable()
+
+    def test_paths_and_validators(self):
+        def same_as_a(el):
+            return el.value == el.parent['a'].value
+        class Schema(Element):
+            a = Element.with_attrs(weak_parent=True)
+            b = Element.with_attrs(weak_parent=True, validators=[same_as_a])
+            @List.of
+            class l(Element):
+                weak_parent = True
+                c = Element.with_attrs(weak_parent=True)
+            l = l.with_attrs(weak_parent=True)
+        el = Schema.from_flat({'a': 1, 'b': 1, 'l.0.c': 2, 'l.1.c': 3})
+        self.assertEqual(el['l'][1]['c'].path, 'l.1.c')
+        self.assertIs(el['l'][1].parent, el['l'])
+        self.assertTrue(el.is_valid())
+        el['b'].value = 2
+        self.assertTrue(el.dirty)
+        self.assertFalse(el.is_valid())
+
+    def test_child_outliving_its_parent(self):
+        class Schema(Element):
+            b = Element.with_attrs(weak_parent=True)
+        child = Schema.from_flat({'b': 1})['b']
+        self.assertEqual(child.value, 1)
+        self.assertEqual(child.path, 'b')
+        self.assertIs(child.parent, child.__class__.parent)
+
+
+class TestThreadSafety(unittest.TestCase):
+    def hammer(self, func, threads=8):
+        errors = []
+        start = threading.Event()
+        def run(idx):
+            start.wait()
+            try:
+                func(idx)
+            except Exception, err:
+                errors.append(err)
+        workers = [threading.Thread(target=run, args=(idx,))
+                   for idx in xrange(threads)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+    def test_one_schema_from_many_threads(self):
+        from skimpy.compiler import compile_schema
+        def positive(el):
+            return el.value > 0
+        class Schema(Element):
+            a = Element.with_attrs(converter=int, validators=[positive])
+            class b(Element):
+                c = Element.with_attrs(converter=int)
+            l = List.of(Element.with_attrs(converter=int))
+        flat = {'a': '1', 'b.c': '2', 'l.0': '3', 'l.1': '4'}
+        expected = {'a': 1, 'b.c': 2, 'l.0': 3, 'l.1': 4}
+        seen = dict((key, set()) for key in ('a', 'b', 'c'))
+        def work(idx):
+            for i in xrange(200):
+                if idx == 0 and i % 20 == 0:
+                    Schema['x%d' % (i,)] = Element
+                seen['a'].add(Schema['a'])
+                seen['b'].add(Schema['b'])
+                seen['c'].add(Schema.get_path('b.c'))
+                if i % 2:
+                    el = compile_schema(Schema).from_flat(flat)
+                else:
+                    el = Schema.from_flat(flat)
+                assert el.is_valid()
+                copy = el.copy()
+                el['b']['c'].value = -1
+                el['l'][0].value = -1
+                flattened = copy.flatten()
+                for key, value in expected.iteritems():
+                    assert flattened[key] == value, (key, flattened)
+        self.hammer(work)
+        # Every class was only ever bound once per generation.
+        self.assertTrue(len(seen['a']) <= 11)
+        self.assertIs(Schema['a'], Schema['a'])
+        self.assertEqual(Schema.get_path('b.c').path, 'b.c')
+        self.assertEqual(len([key for key in Schema if key.startswith('x')]),
+                         10)
+
+    def test_path_built_during_schema_change_is_not_kept(self):
+        class Schema(Element):
+            name = 'root'
+            a = Element
+        class name(str):
+            # Stands in for another thread renaming the schema while the
+            # path is being built.
+            def __radd__(self, other):
+                Schema.name = 'renamed'
+                return other + str(self)
+        el = Schema()
+        child = el['a']
+        child.name = name('a')
+        self.assertEqual(child.path, 'root.a')
+        self.assertEqual(child.path, 'renamed.a')
+
+    def test_concurrent_binding(self):
+        class Schema(Element):
+            pass
+        for idx in xrange(50):
+            Schema['c%d' % (idx,)] = Element
+        bound = []
+        def work(idx):
+            bound.append([Schema['c%d' % (i,)] for i in xrange(50)])
+        self.hammer(work, threads=16)
+        for classes in bound:
+            for cls, first in zip(classes, bound[0]):
+                self.assertIs(cls, first)
+
+
+class TestIntern(unittest.TestCase):
+    def test_equal_subtrees_are_shared(self):
+        class Record(Element):
+            id = Element.with_attrs(converter=int)
+            class address(Element):
+                street = Element
+                city = Element
+            tags = List.of(Element.with_attrs(name='tags'))
+        records = [Record.from_flat({
+            'id': str(i), 'address.street': 'Main St', 'address.city': city,
+            'tags.0': 'a', 'tags.1': 'b',
+        }).intern() for i, city in enumerate(
+            ['Springfield', 'Springfield', 'Springfield', 'Shelbyville'])]
+        sources = [record.instances['address'].__dict__['_source']
+                   for record in records]
+        self.assertIs(sources[0], sources[1])
+        self.assertIs(sources[0], sources[2])
+        self.assertIsNot(sources[0], sources[3])
+        self.assertIs(records[0].instances['tags'].__dict__['_source'],
+                      records[2].instances['tags'].__dict__['_source'])
+        self.assertEqual(records[1].flatten(), {
+            'id': 1, 'address.street': 'Main St',
+            'address.city': 'Springfield', 'tags.0': 'a', 'tags.1': 'b',
+        })
+        self.assertEqual(records[1]['tags'][1].path, 'tags.1')
+        self.assertIs(records[1]['address'].parent, records[1])
+
+    def test_paths(self):
+        class Address(Element):
+            city = Element
+        class Record(Element):
+            id = Element
+            address = Address
+            others = List.of(Address)
+        records = [Record.from_flat({
+            'id': str(i), 'address.city': 'Springfield',
+            'others.0.city': 'Springfield',
+        }) for i in xrange(2)]
+        for record in records:
+            record.intern('others.0')
+        self.assertIs(
+            records[0]['others'][0].__dict__['_source'],
+            records[1]['others'][0].__dict__['_source'])
+        self.assertEqual(records[0]['others'][0]['city'].path,
+                         'others.0.city')
+        self.assertFalse('_source' in records[0]['address'].__dict__)
+
+    def test_reads_keep_sharing(self):
+        class Address(Element):
+            street = Element
+            city = Element
+        class Record(Element):
+            id = Element
+            address = Address
+            others = List.of(Address)
+        records = [Record.from_flat({
+            'id': str(i), 'address.street': 'Main St',
+            'address.city': 'Springfield', 'others.0.city': 'Springfield',
+        }).intern() for i in xrange(2)]
+        self.assertEqual(records[0]['address']['city'].value, 'Springfield')
+        self.assertEqual(records[0]['others'][0]['city'].path,
+                         'others.0.city')
+        records[0].flatten()
+        self.assertTrue(records[0].is_valid())
+        address = records[0].instances['address']
+        self.assertNotIn('instances', address.__dict__)
+        frozen = address.__dict__['_source']
+        self.assertIs(records[1].instances['address'].__dict__['_source'],
+                      frozen)
+        self.assertNotIn('_source', frozen.__dict__)
+        for el in frozen._iterdescendants():
+            self.assertTrue(el.__dict__['_frozen'])
+            self.assertNotIn('_copies', el.__dict__)
+
+    def test_writes_are_not_shared(self):
+        class Record(Element):
+            id = Element
+            class address(Element):
+                city = Element
+            tags = List.of(Element.with_attrs(name='tags'))
+        first, second, third = [Record.from_flat({
+            'id': str(i), 'address.city': 'Springfield',
+            'tags.0': 'a', 'tags.1': 'b',
+        }) for i in xrange(3)]
+        first.intern()
+        second.intern()
+        first['address']['city'].value = 'Shelbyville'
+        first['tags'].append(first['tags'].element_type())
+        self.assertEqual(second['address']['city'].value, 'Springfield')
+        self.assertEqual(len(second['tags']), 2)
+        third.intern()
+        self.assertEqual(third['address']['city'].value, 'Springfield')
+
+    def test_revalidates_after_interning(self):
+        class Record(Element):
+            class address(Element):
+                city = Element
+        record = Record.from_flat({'address.city': 'Springfield'})
+        self.assertTrue(record.is_valid())
+        record.intern()
+        self.assertTrue(record.dirty)
+        self.assertTrue(record.is_valid(incremental=True))
+        record['address']['city'].value = 'x'
+        self.assertTrue(record.dirty)
+
+    def test_unhashable_values_are_not_interned(self):
+        class Record(Element):
+            class address(Element):
+                street = Element
+        record = Record()
+        record['address']['street'].value = ['Main St']
+        address = record['address']
+        record.intern()
+        self.assertIs(record['address'], address)
+
+    def test_frozen_subtrees_are_freed(self):
+        class Record(Element):
+            class address(Element):
+                city = Element
+        record = Record.from_flat({'address.city': 'Springfield'}).intern()
+        source = weakref.ref(record.instances['address'].__dict__['_source'])
+        del record
+        gc.collect()
+        self.assertIs(source(), None)
+
+
 class TestWithAttrs(unittest.TestCase):
     def test_calls_with_attrs_on_argument(self):
         class MyElement(Element):
@@ -0,0 +1,77 @@
+import unittest
+
+from skimpy import element
+from skimpy.element import *
+from skimpy.instrument import *
+
+
+def positive(el):
+    return el.value > 0
+
+
+class Schema(Element):
+    a = Element.with_attrs(converter=int, adapter=str, validators=[positive])
+    l = List.of(Element.with_attrs(name='l', converter=int))
+
+
+FLAT = {'a': '1', 'l.0': '2', 'l.1': 'x'}
+
+
+class TestRecording(unittest.TestCase):
+    def test_disabled_by_default(self):
+        self.assertIs(element._recorder, None)
+
+    def test_records_counts_per_path(self):
+        with recording() as recorder:
+            el = Schema.from_flat(FLAT)
+            el.is_valid()
+            el.flatten()
+        self.assertIs(element._recorder, None)
+        stats = recorder.as_dict()
+        self.assertEqual(sorted(stats), ['adapt', 'convert', 'flatten',
+                                         'from_flat', 'validate'])
+        self.assertEqual(sorted(stats['convert']), ['a', 'l.0', 'l.1'])
+        self.assertEqual(stats['validate'].keys(), ['a:positive'])
+        self.assertEqual(stats['from_flat']['']['count'], 1)
+        self.assertTrue(stats['adapt']['a']['time'] >= 0)
+
+    def test_other_ingest_methods_are_recorded(self):
+        with recording() as recorder:
+            Schema.from_urlencoded('a=1&l.0=2')
+            Schema.from_nested({'a': '1', 'l': ['2']})
+            Schema.from_events(iter([('start_map', None), ('map_key', 'a'),
+                                     ('string', '1'), ('end_map', None)]))
+        stats = recorder.as_dict()
+        for kind in ('from_urlencoded', 'from_nested', 'from_events'):
+            self.assertEqual(stats[kind]['']['count'], 1)
+        self.assertEqual(stats['convert']['a']['count'], 3)
+
+    def test_batch_methods_are_recorded_per_record(self):
+        with recording() as recorder:
+            els = list(Schema.from_flat_many([FLAT, FLAT]))
+            list(Schema.flatten_many(els))
+        stats = recorder.as_dict()
+        self.assertEqual(stats['from_flat']['']['count'], 2)
+        self.assertEqual(stats['flatten']['']['count'], 2)
+        self.assertEqual(stats['convert']['a']['count'], 2)
+
+    def test_callback(self):
+        events = []
+        recorder = Recorder(lambda *event: events.append(event[:3]))
+        with recording(recorder):
+            Schema['a'].from_flat({'a': '1'})
+        self.assertEqual(events, [('convert', 'a', None),
+                                  ('from_flat', 'a', None)])
+
+    def test_enable_and_disable(self):
+        recorder = enable()
+        try:
+            Schema.from_flat(FLAT)
+        finally:
+            disable()
+        Schema.from_flat(FLAT)
+        self.assertEqual(recorder.stats[('from_flat', '', None)][0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import cPickle as pickle
+import pickle as pure_pickle
+import sys
+import threading
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from skimpy.element import *
+from skimpy.parallel import *
+
+
+def positive(el):
+    if el.value is not None and el.value <= 0:
+        el.validation_errors.append('not positive')
+        return False
+    return True
+
+
+class Item(Element):
+    n = Element.with_attrs(converter=int, validators=[positive])
+
+
+class Record(Element):
+    n = Element.with_attrs(converter=int, validators=[positive])
+    class sub(Element):
+        m = Element
+    items = List.of(Item)
+
+
+NamedRecord = Record.with_attrs(name='record')
+
+
+class PicklingExecutor(object):
+    def map(self, func, *iterables):
+        for args in zip(*iterables):
+            args = pickle.loads(pickle.dumps(args, 2))
+            yield pickle.loads(pickle.dumps(func(*args), 2))
+
+
+class ThreadingExecutor(object):
+    def __init__(self, workers):
+        self.pool = ThreadPool(workers)
+        self.threads = set()
+
+    def map(self, func, *iterables):
+        def call(args):
+            self.threads.add(threading.current_thread())
+            return func(*args)
+        try:
+            return self.pool.map(call, zip(*iterables))
+        finally:
+            self.pool.close()
+
+
+class WithoutFutures(object):
+    def __enter__(self):
+        self.saved = sys.modules.get('concurrent.futures', self)
+        sys.modules['concurrent.futures'] = None
+
+    def __exit__(self, *exc_info):
+        if self.saved is self:
+            del sys.modules['concurrent.futures']
+        else:
+            sys.modules['concurrent.futures'] = self.saved
+
+
+class TestPickling(unittest.TestCase):
+    def assertRoundTrips(self, cls):
+        for module in (pickle, pure_pickle):
+            for protocol in (0, 2):
+                copy = module.loads(module.dumps(cls, protocol))
+                self.assertIs(copy, cls)
+
+    def test_importable_class(self):
+        self.assertRoundTrips(Record)
+
+    def test_child_classes(self):
+        self.assertRoundTrips(Record.children['n'])
+        self.assertRoundTrips(Record.children['sub'])
+
+    def test_bound_child_classes(self):
+        self.assertRoundTrips(Record['sub'])
+        self.assertRoundTrips(Record['sub']['m'])
+        self.assertRoundTrips(Record.get_path('items.0'))
+        self.assertRoundTrips(Record.get_path('items.1.n'))
+
+    def test_with_attrs_classes(self):
+        for cls in (NamedRecord, Record.with_attrs(name='x'),
+                    List.of(Record)):
+            copy = pickle.loads(pickle.dumps(cls, 2))
+            self.assertIs(copy.__bases__[0], cls.__bases__[0])
+            self.assertEqual(getattr(copy, 'name', None),
+                             getattr(cls, 'name', None))
+            self.assertEqual(copy.path, cls.path)
+
+
+class TestValidateParallel(unittest.TestCase):
+    def test_results_are_in_input_order(self):
+        flats = [{'n': str(i)} for i in xrange(-2, 3)]
+        results = validate_parallel(Record, flats, chunksize=2,
+                                    executor=PicklingExecutor())
+        self.assertEqual([result.valid for result in results],
+                         [False, False, False, True, True])
+        self.assertEqual(results[0].validation_errors,
+                         {'n': ['not positive']})
+        self.assertEqual(results[4].validation_errors, {})
+
+    def test_reports_conversion_errors(self):
+        results = validate_parallel(
+            NamedRecord, [{'record.items.0.n': 'x', 'record.n': '1'}],
+            executor=PicklingExecutor())
+        self.assertEqual(results[0].conversion_errors.keys(),
+                         ['record.items.0.n'])
+        self.assertTrue(isinstance(
+            results[0].conversion_errors['record.items.0.n'], ValueError))
+
+    def test_process_pool(self):
+        flats = [{'n': str(i), 'items.0.n': str(-i)} for i in xrange(20)]
+        results = validate_parallel(Record, flats, chunksize=3, max_workers=2)
+        self.assertEqual([result.valid for result in results],
+                         [False] * 20)
+        self.assertEqual(results[5].validation_errors,
+                         {'items.0.n': ['not positive']})
+
+    def test_process_pool_without_futures(self):
+        flats = [{'n': str(i)} for i in xrange(-5, 5)]
+        with WithoutFutures():
+            results = validate_parallel(Record, flats, chunksize=3,
+                                        max_workers=2)
+        self.assertEqual([result.valid for result in results],
+                         [False] * 6 + [True] * 4)
+
+
+class TestValidateThreaded(unittest.TestCase):
+    def test_results_are_in_input_order(self):
+        flats = [{'n': str(i), 'items.0.n': '1'} for i in xrange(-20, 20)]
+        executor = ThreadingExecutor(4)
+        results = validate_threaded(Record, flats, chunksize=3,
+                                    executor=executor)
+        self.assertEqual([result.valid for result in results],
+                         [False] * 21 + [True] * 19)
+        self.assertEqual(results[0].validation_errors,
+                         {'n': ['not positive']})
+        self.assertTrue(len(executor.threads) > 1)
+
+    def test_thread_pool(self):
+        flats = [{'n': str(i)} for i in xrange(-5, 5)]
+        results = validate_threaded(Record, flats, chunksize=2, max_workers=3)
+        self.assertEqual([result.valid for result in results],
+                         [False] * 6 + [True] * 4)
+        with WithoutFutures():
+            results = validate_threaded(Record, flats, chunksize=2,
+                                        max_workers=3)
+        self.assertEqual([result.valid for result in results],
+                         [False] * 6 + [True] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()